@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Simple TMX library
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmarks for the Simple TMX Library.  Run ``python3
+benchmark.py`` from the source directory to compare the library's tile
+data routines against the straightforward per-tile implementations
+they replaced.
+"""
+
+
+import base64
+import random
+import timeit
+import zlib
+
+from tmx import local, PackedTiles
+
+
+N = 1000000
+REPEAT = 3
+
+
+def legacy_data_decode(data, encoding, compression=None):
+    data = base64.b64decode(data.strip().encode("latin1"))
+    if compression == "zlib":
+        data = zlib.decompress(data)
+
+    ndata = [i for i in data]
+
+    data = []
+    for i in range(0, len(ndata), 4):
+        n = (ndata[i]  + ndata[i + 1] * (2 ** 8) +
+             ndata[i + 2] * (2 ** 16) + ndata[i + 3] * (2 ** 24))
+        data.append(n)
+
+    return data
+
+
+def legacy_data_encode(data, encoding, compression=True,
+                       compressionlevel=None):
+    ndata = []
+    for i in data:
+        n = [i % (2 ** 8), i // (2 ** 8), i // (2 ** 16), i // (2 ** 24)]
+        ndata.extend(n)
+
+    data = b''.join([bytes((i,)) for i in ndata])
+
+    if compression:
+        if compressionlevel is None:
+            compressionlevel = -1
+        data = zlib.compress(data, compressionlevel)
+
+    return base64.b64encode(data).decode("latin1")
+
+
+def bench(desc, func):
+    t = min(timeit.repeat(func, number=1, repeat=REPEAT))
+    print(f"  {desc}: {t * 1000:.1f} ms")
+    return t
+
+
+random.seed(0)
+gids = [random.randrange(2 ** 32) for i in range(N)]
+raw = b''.join([n.to_bytes(4, "little") for n in gids])
+encoded = base64.b64encode(zlib.compress(raw)).decode("latin1")
+
+print(f"data_decode, {N} tiles, base64 + zlib")
+assert list(local.data_decode(encoded, "base64", "zlib")) == gids
+t_old = bench("per-tile loop", lambda: legacy_data_decode(encoded, "base64",
+                                                          "zlib"))
+t_new = bench("local.data_decode",
+              lambda: local.data_decode(encoded, "base64", "zlib"))
+print(f"  speedup: {t_old / t_new:.1f}x")
+
+# The old encoder only handled global tile IDs below 65536.
+small_gids = [n % 65536 for n in gids]
+
+print(f"data_encode, {N} tiles, base64 + zlib")
+assert (local.data_encode(small_gids, "base64", True) ==
+        legacy_data_encode(small_gids, "base64", True))
+t_old = bench("per-tile loop",
+              lambda: legacy_data_encode(small_gids, "base64", True))
+t_new = bench("local.data_encode",
+              lambda: local.data_encode(small_gids, "base64", True))
+print(f"  speedup: {t_old / t_new:.1f}x")
+
+print(f"data_encode, {N} tiles, base64")
+t_old = bench("per-tile loop",
+              lambda: legacy_data_encode(small_gids, "base64", False))
+t_new = bench("local.data_encode",
+              lambda: local.data_encode(small_gids, "base64", False))
+print(f"  speedup: {t_old / t_new:.1f}x")
+
+print(f"split_gids, {N} tiles")
+packed = PackedTiles(gids)
+assert (list(local.split_gids(packed.data)[0]) ==
+        [t.gid for t in packed])
+t_old = bench("per-tile LayerTile objects", lambda: list(packed))
+t_new = bench("local.split_gids", lambda: local.split_gids(packed.data))
+print(f"  speedup: {t_old / t_new:.1f}x")
@@ -33,7 +33,7 @@ class Frame:
     """
 
     def __init__(self, tileid, duration):
-        self.tileid = tid
+        self.tileid = tileid
         self.duration = duration
 
     @classmethod
@@ -45,7 +45,7 @@ class Frame:
         don't typically need to use it.
         """
         tileid = int(elem.attrib.get("tileid", 0))
-        duration = float(elem.attrib.get("duration", 0))
+        duration = int(elem.attrib.get("duration", 0))
 
         return cls(tileid, duration)
 
@@ -56,7 +56,7 @@ class Frame:
         This is a low-level method used internally by this library; you
         don't typically need to use it.
         """
-        attr = {"tileid", "duration"}
+        attr = {"tileid": self.tileid, "duration": self.duration}
         elem = ET.Element("frame", attrib=local.clean_dict(attr))
 
         return elem
@@ -57,6 +57,11 @@ class GroupLayer:
        the map's tile layers, object groups, group layers, and image
        layers, respectively.  Those that appear in this list first are
        rendered first (i.e. furthest in the back).
+
+       Like :attr:`TileMap.layers`, lists assigned to this attribute
+       are copied to a list which reports its changes, so make changes
+       through this attribute rather than through the list which was
+       assigned.
     """
 
     def __init__(self, name, offsetx=0, offsety=0, opacity=1, visible=True,
@@ -69,10 +74,56 @@ class GroupLayer:
         self.properties = properties or []
         self.layers = layers or []
 
+    def __getstate__(self):
+        # The map or group layer containing the group layer sets itself
+        # again when it is restored.
+        state = self.__dict__.copy()
+        state.pop("_parent", None)
+        return state
+
+    def __setstate__(self, state):
+        # States pickled before layers became a property store it
+        # under its own name.
+        state = state.copy()
+        layers = state.pop("_layers", state.pop("layers", None))
+        self.__dict__.update(state)
+        self.layers = layers
+
+    @property
+    def layers(self):
+        return self._layers
+
+    @layers.setter
+    def layers(self, value):
+        old = self.__dict__.get("_layers")
+        if old is not None:
+            old.callback = None
+            _update_layers(self, [], old)
+        self._layers = local.ObservedList(value, self._layers_changed)
+        _update_layers(self, self._layers, [])
+
+    def _layers_changed(self, added, removed, in_order):
+        # Called by the list of layers when it is changed.
+        _update_layers(self, added, removed)
+
+    def _get_id_index(self):
+        # Return the object ID index of the map containing the group
+        # layer, or None if there isn't one.
+        parent = self.__dict__.get("_parent")
+        return parent._get_id_index() if parent is not None else None
+
     @classmethod
-    def read_elem(cls, elem, fd):
+    def read_elem(cls, elem, fd, packed=False, lazy=False,
+                  packed_objects=False, compressionlevel=None):
         """
         Read XML element ``elem`` and return an object of this class.
+        If ``packed`` is true, tiles are read into :class:`PackedTiles`
+        objects, and polygon and polyline points into
+        :class:`PackedPoints` objects.  If ``lazy`` is true, encoded
+        tile data is kept as-is and only decoded when it is first
+        accessed.  If ``packed_objects`` is true, objects are read into
+        :class:`PackedObjects` objects.  ``compressionlevel`` is used as
+        in :meth:`Layer.read_elem`.
 
         This is a low-level method used internally by this library; you
         don't typically need to use it.
@@ -90,13 +141,17 @@ class GroupLayer:
                 properties.extend(local.read_list_elem(child, "property",
                                                        Property, fd))
             elif child.tag == "layer":
-                layers.append(Layer.read_elem(child, fd))
+                layers.append(Layer.read_elem(child, fd, packed, lazy,
+                                              compressionlevel))
             elif child.tag == "objectgroup":
-                layers.append(ObjectGroup.read_elem(child, fd))
+                layers.append(ObjectGroup.read_elem(child, fd, packed,
+                                                    packed_objects))
             elif child.tag == "imagelayer":
                 layers.append(ImageLayer.read_elem(child, fd))
             elif child.tag == "group":
-                layers.append(GroupLayer.read_elem(child, fd))
+                layers.append(GroupLayer.read_elem(child, fd, packed, lazy,
+                                                   packed_objects,
+                                                   compressionlevel))
 
         return cls(name, offsetx, offsety, opacity, visible, properties, layers)
 
@@ -107,6 +162,43 @@ class GroupLayer:
         This is a low-level method used internally by this library; you
         don't typically need to use it.
         """
+        elem = self._get_elem(fd, encoding, compression, compressionlevel)
+
+        for layer in self.layers:
+            elem.append(layer.get_elem(fd, encoding, compression,
+                                       compressionlevel))
+
+        return elem
+
+    def write_elem(self, f, fd, encoding, compression, compressionlevel,
+                   workers=None):
+        """
+        Write the XML element :meth:`get_elem` would return to the
+        binary file object ``f`` without creating it in full: child
+        layers are written as they are created (see
+        :func:`tmx.local.write_elems`).
+
+        This is a low-level method used internally by this library; you
+        don't typically need to use it.
+        """
+        elem = self._get_elem(fd, encoding, compression, compressionlevel)
+
+        if not self.layers:
+            local.write_elem(f, elem)
+            return
+
+        local.write_open_elem(f, elem)
+        local.write_elems(f, self.layers, fd, encoding, compression,
+                          compressionlevel, workers)
+        local.write_close_elem(f, elem)
+
+    def _streams(self, encoding):
+        # Whether write_elem() writes anything incrementally.
+        return True
+
+    def _get_elem(self, fd, encoding, compression, compressionlevel):
+        # Return the group element with its properties but without its
+        # layers.
         attr = {"name": self.name, "offsetx": self.offsetx,
                 "offsety": self.offsety}
         if not self.visible:
@@ -120,8 +212,23 @@ class GroupLayer:
                 self.properties, "properties", fd, encoding, compression,
                 compressionlevel))
 
-        for layer in self.layers:
-            elem.append(layer.get_elem(fd, encoding, compression,
-                                       compressionlevel))
-
         return elem
+
+
+def _update_layers(owner, added, removed):
+    # Make ``owner``, a TileMap or GroupLayer object, the parent of the
+    # object groups and group layers in the list ``added`` and no
+    # longer the parent of those in the list ``removed``, and update the
+    # object ID index of the map containing ``owner``.
+    for layer in removed:
+        if (isinstance(layer, (ObjectGroup, GroupLayer)) and
+                layer.__dict__.get("_parent") is owner):
+            layer._parent = None
+    for layer in added:
+        if isinstance(layer, (ObjectGroup, GroupLayer)):
+            layer._parent = owner
+
+    index = owner._get_id_index()
+    if index is not None:
+        index.remove_layers(removed)
+        index.add_layers(added)
@@ -13,10 +13,13 @@
 # limitations under the License.
 
 
+import array
 import xml.etree.ElementTree as ET
 
 from . import local
 from .LayerChunk import LayerChunk
+from .LayerTile import LayerTile
+from .PackedTiles import PackedTiles
 from .Property import Property
 
 
@@ -63,7 +66,15 @@ class Layer:
     .. attribute:: tiles
 
        A list of :class:`LayerTile` objects indicating the tiles of the
-       layer.
+       layer.  This can also be a :class:`PackedTiles` object, which
+       stores the tiles far more compactly.
+
+       If the layer was loaded lazily (see :meth:`TileMap.load`), the
+       tile data is only decoded the first time this attribute is
+       accessed.  Until then, saving the layer with the same encoding,
+       compression, and compression level (see
+       :attr:`TileMap.compressionlevel`) writes the original encoded
+       data back as-is.
 
        The coordinates of each tile is determined by the tile's index
        within this list.  Exactly how the tiles are positioned is
@@ -73,6 +84,12 @@ class Layer:
 
        A list of :class:`LayerChunk` objects indicating the chunks of
        the layer.
+
+       Chunks are looked up by :meth:`get_tile` and :meth:`set_tile`
+       through an index keyed by chunk grid coordinates, which is
+       rebuilt automatically whenever chunks are added or removed.
+       If a chunk is replaced or moved without changing the number of
+       chunks, assign a new list to this attribute.
     """
 
     def __init__(self, name, opacity=1, visible=True, offsetx=0, offsety=0,
@@ -87,13 +104,214 @@ class Layer:
         self.offsetx = offsetx
         self.offsety = offsety
         self.properties = properties or []
-        self.tiles = tiles or []
+        self.tiles = tiles if tiles is not None else []
         self.chunks = chunks or []
 
+        # The tile data last loaded or encoded, by (encoding,
+        # compression, level); see local.write_tiles().
+        self._encoded_cache = {}
+        self._chunk_index = None
+
+    def __getstate__(self):
+        # The chunk index and encoded data cache are rebuilt when needed
+        # rather than stored.
+        state = self.__dict__.copy()
+        state["_encoded_cache"] = {}
+        state["_chunk_index"] = None
+        return state
+
+    @property
+    def tiles(self):
+        if self._tiles is None:
+            self._decode()
+        return self._tiles
+
+    @tiles.setter
+    def tiles(self, value):
+        self._tiles = value
+        self._encoded = None
+
+    @property
+    def bounds(self):
+        """
+        The area covered by the layer's tiles as a tuple ``(x, y,
+        width, height)`` in tiles.  For layers with chunks (see
+        :meth:`get_tile`), this is the bounding rectangle of the
+        chunks, or :const:`None` if there are none; otherwise it is
+        ``(0, 0, width, height)``.
+        """
+        if not self._chunked():
+            return (0, 0, self.width, self.height)
+
+        index = self._get_chunk_index()
+        if index.bounds is None:
+            return None
+        x1, y1, x2, y2 = index.bounds
+        return (x1, y1, x2 - x1, y2 - y1)
+
+    def get_tile(self, x, y):
+        """
+        Return the tile at position ``(x, y)`` in tiles as a
+        :class:`LayerTile` object.
+
+        If the layer has chunks or no tiles, as in infinite maps, the
+        chunk containing the position is found in constant time, and a
+        tile with a global ID of ``0`` is returned if no chunk contains
+        it.  Otherwise, :exc:`IndexError` is raised if the position is
+        outside the layer.
+        """
+        if not self._chunked():
+            return self.tiles[self._tile_index(x, y)]
+
+        chunk = self._find_chunk(x, y)
+        if chunk is None:
+            return LayerTile(0)
+        return chunk.tiles[(y - chunk.y) * chunk.width + x - chunk.x]
+
+    def set_tile(self, x, y, tile, chunksize=(16, 16)):
+        """
+        Set the tile at position ``(x, y)`` in tiles to ``tile``, which
+        can be a :class:`LayerTile` object or a raw global tile ID.
+
+        If the layer has no chunks but a size (``width`` and
+        ``height``), and holds fewer tiles than that, it is first
+        filled up with empty tiles (``0``), stored the same way as its
+        existing tiles.  If the layer has chunks or no tiles and no
+        size, as in infinite maps, and no chunk contains the position,
+        a new empty chunk containing it is added first.  New chunks
+        are aligned to a grid of chunks the same size as the existing
+        chunks, or ``chunksize`` (a tuple ``(width, height)``) if
+        there are none, and store their tiles the same way as the
+        existing chunks.  Otherwise, :exc:`IndexError` is raised if
+        the position is outside the layer.
+        """
+        if not self.chunks and self.width and self.height:
+            self._fill_tiles()
+        if not self._chunked():
+            i = self._tile_index(x, y)
+            if not isinstance(self.tiles, PackedTiles):
+                tile = _layer_tile(tile)
+            self.tiles[i] = tile
+            return
+
+        chunk = self._find_chunk(x, y)
+        if chunk is None:
+            chunk = self._add_chunk(x, y, chunksize)
+        if not isinstance(chunk.tiles, PackedTiles):
+            tile = _layer_tile(tile)
+        chunk.tiles[(y - chunk.y) * chunk.width + x - chunk.x] = tile
+
+    def region(self, x, y, width, height):
+        """
+        Return the raw global tile IDs (as returned by
+        ``int(tile)``) of the rectangle of tiles with its top-left
+        corner at position ``(x, y)`` and the indicated size in tiles,
+        as a :class:`PackedTiles` object holding ``width * height``
+        tiles in row-major order.  Positions outside the layer, past
+        the last of its tiles, or not covered by any chunk are empty
+        (``0``).
+
+        Only the rows of the layer's tiles or of the chunks overlapping
+        the rectangle are copied, and no :class:`LayerTile` objects are
+        created unless the tiles are stored as a list of them.
+        """
+        block = array.array(local.GID_TYPECODE, bytes(4 * width * height))
+        rect = (x, y, width, height)
+
+        if not self._chunked():
+            _copy_region(block, rect, self.tiles,
+                         (0, 0, self.width, self.height))
+        else:
+            for chunk in self._get_chunk_index().overlapping(*rect):
+                _copy_region(block, rect, chunk.tiles,
+                             (chunk.x, chunk.y, chunk.width, chunk.height))
+
+        return PackedTiles(block)
+
+    def _decode(self, keep=True):
+        # Decode the lazily loaded tile data, keeping it in the encoded
+        # data cache if ``keep`` is true.
+        data, encoding, compression, level, packed = self._encoded
+        cache = self._encoded_cache if keep else None
+        self._tiles = local.decode_tiles(data, encoding, compression, packed,
+                                         cache, level)
+        self._encoded = None
+
+    def _chunked(self):
+        # Whether tiles are stored in chunks rather than in self.tiles.
+        return bool(self.chunks) or not self.tiles
+
+    def _fill_tiles(self):
+        # Fill self.tiles with empty tiles up to the size of the layer.
+        tiles = self.tiles
+        n = self.width * self.height - len(tiles)
+        if n <= 0:
+            return
+        if isinstance(tiles, PackedTiles):
+            data = tiles.data
+            if not isinstance(data, array.array):
+                data = array.array(local.GID_TYPECODE, data)
+            data.frombytes(bytes(4 * n))
+            tiles.data = data
+        else:
+            tiles.extend(LayerTile(0) for i in range(n))
+
+    def _tile_index(self, x, y):
+        # Return the index in self.tiles of the tile at (x, y).
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            e = "Tile position ({}, {}) out of range.".format(x, y)
+            raise IndexError(e)
+        return y * self.width + x
+
+    def _get_chunk_index(self):
+        # Return the chunk index, rebuilding it if chunks were added or
+        # removed since it was built.
+        index = self._chunk_index
+        if (index is None or index.chunks is not self.chunks or
+                index.count != len(self.chunks)):
+            index = _ChunkIndex(self.chunks)
+            self._chunk_index = index
+        return index
+
+    def _find_chunk(self, x, y):
+        # Return the chunk containing (x, y), or None.
+        index = self._get_chunk_index()
+        chunk = index.find(x, y)
+        if chunk is None and index.stale:
+            self._chunk_index = None
+            chunk = self._get_chunk_index().find(x, y)
+        return chunk
+
+    def _add_chunk(self, x, y, chunksize):
+        # Add and return a new empty chunk containing (x, y).
+        index = self._get_chunk_index()
+        if index.size is None:
+            index.size = tuple(chunksize)
+        width, height = index.size
+        n = width * height
+        if index.packed:
+            tiles = PackedTiles(array.array(local.GID_TYPECODE, bytes(4 * n)))
+        else:
+            tiles = [LayerTile(0) for i in range(n)]
+
+        chunk = LayerChunk(x // width * width, y // height * height, width,
+                           height, tiles)
+        self.chunks.append(chunk)
+        index.add(chunk)
+        return chunk
+
     @classmethod
-    def read_elem(cls, elem, fd):
+    def read_elem(cls, elem, fd, packed=False, lazy=False,
+                  compressionlevel=None):
         """
         Read XML element ``elem`` and return an object of this class.
+        If ``packed`` is true, tiles are read into :class:`PackedTiles`
+        objects.  If ``lazy`` is true, encoded tile data is kept as-is
+        and only decoded when it is first accessed, after which it is
+        kept to be written back as long as the tiles are unchanged (see
+        :meth:`TileMap.save`), as if it was compressed with compression
+        level ``compressionlevel``.  Tile data which is decoded right
+        away is not kept, to save memory.
 
         This is a low-level method used internally by this library; you
         don't typically need to use it.
@@ -114,6 +332,7 @@ class Layer:
         offsety = int(elem.attrib.get("offsety", 0))
         properties = []
         tiles = []
+        encoded = None
         chunks = []
 
         for child in elem:
@@ -123,14 +342,26 @@ class Layer:
             elif child.tag == "data":
                 encoding = child.attrib.get("encoding")
                 compression = child.attrib.get("compression")
-                tiles = local.read_tiles(child, encoding, compression)
+                data = (child.text or "").strip()
+                if lazy and encoding and data:
+                    encoded = (data, encoding, compression, compressionlevel,
+                               packed)
+                else:
+                    tiles = local.read_tiles(child, encoding, compression,
+                                             packed)
 
                 for chunk in child.findall("chunk"):
-                    chunks.append(LayerChunk.read_elem(chunk, fd, encoding,
-                                                       compression))
+                    chunks.append(LayerChunk.read_elem(
+                        chunk, fd, encoding, compression, packed, lazy,
+                        compressionlevel))
 
-        return cls(name, opacity, visible, offsetx, offsety, properties, tiles,
+        self = cls(name, opacity, visible, offsetx, offsety, properties, tiles,
                    id_, width, height, chunks)
+        if encoded is not None:
+            self._tiles = None
+            self._encoded = encoded
+
+        return self
 
     def get_elem(self, fd, encoding, compression, compressionlevel):
         """
@@ -139,6 +370,68 @@ class Layer:
         This is a low-level method used internally by this library; you
         don't typically need to use it.
         """
+        elem, data = self._get_elems(fd, encoding, compression,
+                                     compressionlevel)
+
+        if data is not None:
+            if data.text is None and self.tiles:
+                local.write_tiles(self.tiles, data, encoding, compression,
+                                  compressionlevel, self._encoded_cache)
+
+            for chunk in self.chunks:
+                data.append(chunk.get_elem(fd, encoding, compression,
+                                           compressionlevel))
+
+            elem.append(data)
+
+        return elem
+
+    def write_elem(self, f, fd, encoding, compression, compressionlevel,
+                   workers=None):
+        """
+        Write the XML element :meth:`get_elem` would return to the
+        binary file object ``f`` without creating it in full: chunks
+        are written as they are created (see
+        :func:`tmx.local.write_elems`), and CSV and unencoded tile data
+        is written a block at a time.
+
+        This is a low-level method used internally by this library; you
+        don't typically need to use it.
+        """
+        elem, data = self._get_elems(fd, encoding, compression,
+                                     compressionlevel)
+
+        stream_tiles = False
+        if data is not None and data.text is None and self.tiles:
+            if encoding in (None, "csv"):
+                stream_tiles = True
+            else:
+                local.write_tiles(self.tiles, data, encoding, compression,
+                                  compressionlevel, self._encoded_cache)
+
+        if data is None or not (stream_tiles or self.chunks):
+            if data is not None:
+                elem.append(data)
+            local.write_elem(f, elem)
+            return
+
+        local.write_open_elem(f, elem)
+        local.write_open_elem(f, data)
+        if stream_tiles:
+            local.write_tile_data(f, self.tiles, encoding)
+        local.write_elems(f, self.chunks, fd, encoding, compression,
+                          compressionlevel, workers)
+        local.write_close_elem(f, data)
+        local.write_close_elem(f, elem)
+
+    def _streams(self, encoding):
+        # Whether write_elem() writes anything incrementally.
+        return bool(self.chunks) or encoding in (None, "csv")
+
+    def _get_elems(self, fd, encoding, compression, compressionlevel):
+        # Return the layer element with its properties, and its data
+        # element with any reused encoded tile data but without tiles
+        # or chunks (or None if the layer has no data).
         attr = {"id": self.id, "name": self.name, "width": self.width,
                 "height": self.height}
         if self.opacity < 1:
@@ -152,19 +445,135 @@ class Layer:
         elem = ET.Element("layer", attrib=local.clean_dict(attr))
 
         if self.properties:
-            elem.append(local.get_list_elem(self.properties, "properties", fd,
-                                            encoding, compression))
+            elem.append(local.get_list_elem(
+                self.properties, "properties", fd, encoding, compression,
+                compressionlevel))
 
-        if self.tiles or self.chunks:
+        data = None
+        if self._encoded is not None or self.tiles or self.chunks:
             attr = {"encoding": encoding, "compression": compression}
-            child = ET.Element("data", attrib=local.clean_dict(attr))
-
-            if self.tiles:
-                local.write_tiles(self.tiles, child, encoding, compression,
-                                  compressionlevel)
-
+            data = ET.Element("data", attrib=local.clean_dict(attr))
+
+            key = (encoding, compression, compressionlevel)
+            if self._encoded is not None and self._encoded[1:4] == key:
+                data.text = self._encoded[0]
+
+        return elem, data
+
+
+def _layer_tile(tile):
+    # Return ``tile`` as a LayerTile object.
+    if isinstance(tile, LayerTile):
+        return tile
+    return LayerTile.from_int(int(tile))
+
+
+class _ChunkIndex:
+
+    # An index of the chunks of a layer by chunk grid coordinates.
+    # Chunks which aren't aligned to the grid of the first chunk's size
+    # make the index irregular, in which case lookups which miss fall
+    # back to a linear search.  Finding a chunk which has been moved
+    # marks the index as stale.
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.count = 0
+        self.cells = {}
+        self.size = None
+        self.regular = True
+        self.bounds = None
+        self.packed = False
+        self.stale = False
+        if chunks:
+            first = chunks[0]
+            self.size = (first.width, first.height)
+            self.packed = first._is_packed()
+        for chunk in chunks:
+            self.add(chunk)
+
+    def add(self, chunk):
+        width, height = self.size
+        if ((chunk.width, chunk.height) != self.size or chunk.x % width or
+                chunk.y % height):
+            self.regular = False
+        self.cells.setdefault((chunk.x // width, chunk.y // height), chunk)
+        self.count = len(self.chunks)
+
+        x2 = chunk.x + chunk.width
+        y2 = chunk.y + chunk.height
+        if self.bounds is None:
+            self.bounds = (chunk.x, chunk.y, x2, y2)
+        else:
+            bx1, by1, bx2, by2 = self.bounds
+            self.bounds = (min(bx1, chunk.x), min(by1, chunk.y),
+                           max(bx2, x2), max(by2, y2))
+
+    def overlapping(self, x, y, width, height):
+        # Return a list of the chunks overlapping the rectangle.
+        if self.size is None or width <= 0 or height <= 0:
+            return []
+        if not self.regular:
+            return [chunk for chunk in self.chunks
+                    if (chunk.x < x + width and x < chunk.x + chunk.width and
+                        chunk.y < y + height and y < chunk.y + chunk.height)]
+
+        cwidth, cheight = self.size
+        chunks = []
+        for cy in range(y // cheight, (y + height - 1) // cheight + 1):
+            for cx in range(x // cwidth, (x + width - 1) // cwidth + 1):
+                chunk = self.cells.get((cx, cy))
+                if chunk is not None:
+                    chunks.append(chunk)
+        return chunks
+
+    def find(self, x, y):
+        if self.size is None:
+            return None
+        width, height = self.size
+        chunk = self.cells.get((x // width, y // height))
+        if chunk is not None:
+            if _contains(chunk, x, y):
+                return chunk
+            self.stale = True
+        if not self.regular:
             for chunk in self.chunks:
-                child.append(chunk.get_elem(fd, encoding, compression,
-                                            compressionlevel))
-
-        return elem
+                if _contains(chunk, x, y):
+                    return chunk
+        return None
+
+
+def _copy_region(block, rect, tiles, area):
+    # Copy the raw global tile IDs of the part of ``tiles``, covering
+    # the rectangle ``area``, which overlaps the rectangle ``rect`` to
+    # the corresponding rows of ``block``, which covers ``rect``.
+    # Only the tiles that ``tiles`` actually holds are copied, so the
+    # size of ``block`` never changes; an area without a width holds no
+    # tiles that can be placed.
+    x, y, width, height = rect
+    ax, ay, awidth, aheight = area
+    if not awidth:
+        return
+    count = len(tiles)
+    if aheight is None:
+        aheight = -(-count // awidth)
+    x1 = max(x, ax)
+    x2 = min(x + width, ax + awidth)
+    if x1 >= x2:
+        return
+
+    if isinstance(tiles, PackedTiles):
+        tiles = tiles.data
+    for row in range(max(y, ay), min(y + height, ay + aheight)):
+        src = (row - ay) * awidth - ax
+        end = min(src + x2, count)
+        if src + x1 >= end:
+            break
+        dst = (row - y) * width - x
+        block[dst + x1:dst + end - src] = local.gid_array(tiles[src + x1:end])
+
+
+def _contains(chunk, x, y):
+    # Whether ``chunk`` contains position (x, y).
+    return (chunk.x <= x < chunk.x + chunk.width and
+            chunk.y <= y < chunk.y + chunk.height)
@@ -16,6 +16,7 @@
 import xml.etree.ElementTree as ET
 
 from . import local
+from .PackedTiles import PackedTiles
 
 
 class LayerChunk:
@@ -40,7 +41,22 @@ class LayerChunk:
     .. attribute:: tiles
 
        A list of :class:`LayerTile` objects indicating the tiles of the
-       chunk.
+       chunk.  This can also be a :class:`PackedTiles` object, which
+       stores the tiles far more compactly.
+
+       If the chunk was loaded lazily (see :meth:`TileMap.load`), the
+       tile data is only decoded the first time this attribute is
+       accessed.  Until then, saving the chunk with the same encoding,
+       compression, and compression level (see
+       :attr:`TileMap.compressionlevel`) writes the original encoded
+       data back as-is.
+
+       If the map was loaded with a chunk budget (see
+       :meth:`TileMap.load`), the tiles may be dropped from memory
+       again once other chunks have been accessed, so don't keep
+       references to this list or to its tiles; access the tiles
+       through this attribute or :meth:`Layer.get_tile` and
+       :meth:`Layer.set_tile` each time instead.
 
        The coordinates of each tile is determined by the tile's index
        within this list.  Exactly how the tiles are positioned is
@@ -52,12 +68,72 @@ class LayerChunk:
         self.y = y
         self.width = width
         self.height = height
-        self.tiles = tiles or []
+
+        # Paging state; see local.ChunkPager.
+        self._pager = None
+        self._spill = None
+        self._digest = None
+
+        self.tiles = tiles if tiles is not None else []
+
+        # The tile data last loaded or encoded, by (encoding,
+        # compression, level); see local.write_tiles().
+        self._encoded_cache = {}
+
+    def __getstate__(self):
+        # The encoded data cache is rebuilt when needed rather than
+        # stored, and paged chunks are stored unpaged.
+        state = self.__dict__.copy()
+        state["_encoded_cache"] = {}
+        if self._pager is not None:
+            if self._tiles is None and self._encoded is None:
+                state["_tiles"] = self._pager.read(self)
+            state["_pager"] = None
+            state["_spill"] = None
+            state["_digest"] = None
+        return state
+
+    @property
+    def tiles(self):
+        loaded = self._tiles is None
+        if loaded:
+            if self._encoded is not None:
+                self._decode()
+            else:
+                self._tiles = self._pager.read(self)
+        if self._pager is not None:
+            self._pager.touch(self, loaded)
+        return self._tiles
+
+    @tiles.setter
+    def tiles(self, value):
+        self._tiles = value
+        self._encoded = None
+        self._digest = None
+        if self._pager is not None:
+            self._pager.touch(self)
+
+    def _decode(self, keep=True):
+        # Decode the lazily loaded tile data, keeping it in the encoded
+        # data cache if ``keep`` is true.
+        data, encoding, compression, level, packed = self._encoded
+        cache = self._encoded_cache if keep else None
+        self._tiles = local.decode_tiles(data, encoding, compression, packed,
+                                         cache, level)
+        # Paged chunks keep their encoded data to drop back to.
+        if self._pager is None:
+            self._encoded = None
 
     @classmethod
-    def read_elem(cls, elem, fd, encoding, compression):
+    def read_elem(cls, elem, fd, encoding, compression, packed=False,
+                  lazy=False, compressionlevel=None):
         """
         Read XML element ``elem`` and return an object of this class.
+        If ``packed`` is true, tiles are read into a
+        :class:`PackedTiles` object.  If ``lazy`` is true, encoded tile
+        data is kept as-is and only decoded when it is first accessed.
+        ``compressionlevel`` and the encoded data cache are used as in
+        :meth:`Layer.read_elem`.
 
         This is a low-level method used internally by this library; you
         don't typically need to use it.
@@ -66,7 +142,21 @@ class LayerChunk:
         y = int(elem.attrib.get("y", 0))
         width = int(elem.attrib.get("width", 0))
         height = int(elem.attrib.get("height", 0))
-        tiles = local.read_tiles(elem, encoding, compression)
+        tiles = []
+        encoded = None
+
+        data = (elem.text or "").strip()
+        if lazy and encoding and data:
+            encoded = (data, encoding, compression, compressionlevel, packed)
+        else:
+            tiles = local.read_tiles(elem, encoding, compression, packed)
+
+        self = cls(x, y, width, height, tiles)
+        if encoded is not None:
+            self._tiles = None
+            self._encoded = encoded
+
+        return self
 
     def get_elem(self, fd, encoding, compression, compressionlevel):
         """
@@ -79,7 +169,22 @@ class LayerChunk:
                 "height": self.height}
         elem = ET.Element("chunk", attrib=local.clean_dict(attr))
 
+        key = (encoding, compression, compressionlevel)
+        if (self._tiles is None and self._encoded is not None and
+                self._encoded[1:4] == key):
+            elem.text = self._encoded[0]
+            return elem
+
         local.write_tiles(self.tiles, elem, encoding, compression,
-                          compressionlevel)
+                          compressionlevel, self._encoded_cache)
 
         return elem
+
+    def _is_packed(self):
+        # Whether the tiles are, or will be once decoded, a PackedTiles
+        # object.
+        if self._tiles is not None:
+            return isinstance(self._tiles, PackedTiles)
+        elif self._encoded is not None:
+            return self._encoded[4]
+        return self._spill[3]
@@ -37,13 +37,34 @@ class LayerTile:
 
        Whether or not the tile is flipped diagonally (X and Y axis
        swapped).
+
+    .. attribute:: hexrotate
+
+       Whether or not the tile is rotated 120 degrees.  Only meaningful
+       for hexagonal maps.
     """
 
-    def __init__(self, gid, hflip=False, vflip=False, dflip=False):
+    def __init__(self, gid, hflip=False, vflip=False, dflip=False,
+                 hexrotate=False):
         self.gid = gid
         self.hflip = hflip
         self.vflip = vflip
         self.dflip = dflip
+        self.hexrotate = hexrotate
+
+    @classmethod
+    def from_int(cls, n):
+        """
+        Return an object of this class representing the raw 32-bit
+        global tile ID ``n``, with the flip flags packed into its high
+        bits (as returned by ``int(tile)``).
+        """
+        gid = (n - (n & 2**31) - (n & 2**30) - (n & 2**29) - (n & 2**28))
+        hflip = bool(n & 2**31)
+        vflip = bool(n & 2**30)
+        dflip = bool(n & 2**29)
+        hexrotate = bool(n & 2**28)
+        return cls(gid, hflip, vflip, dflip, hexrotate)
 
     def __int__(self):
         r = self.gid
@@ -53,6 +74,8 @@ class LayerTile:
             r |= 2 ** 30
         if self.dflip:
             r |= 2 ** 29
+        if self.hexrotate:
+            r |= 2 ** 28
 
         return r
 
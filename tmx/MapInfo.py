@@ -0,0 +1,88 @@
+# Simple TMX library
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+class MapInfo:
+
+    """
+    A lightweight summary of a TMX file, as returned by
+    :meth:`TileMap.probe`.
+
+    .. attribute:: version
+
+       The TMX format version.
+
+    .. attribute:: tiledversion
+
+       The tiled version used to save the file, or :const:`None` if
+       unspecified.
+
+    .. attribute:: orientation
+
+       Map orientation.  Can be "orthogonal", "isometric", "staggered",
+       or "hexagonal".
+
+    .. attribute:: renderorder
+
+       The order in which tiles are rendered.
+
+    .. attribute:: width
+
+       The width of the map in tiles.
+
+    .. attribute:: height
+
+       The height of the map in tiles.
+
+    .. attribute:: tilewidth
+
+       The width of a tile.
+
+    .. attribute:: tileheight
+
+       The height of a tile.
+
+    .. attribute:: infinite
+
+       Whether or not the map is infinite.
+
+    .. attribute:: tilesets
+
+       A list of the names of the map's tilesets, or :const:`None` if
+       they weren't read.
+
+    .. attribute:: layers
+
+       A list of ``(cls, name)`` tuples for each of the map's layers in
+       document order, including those inside of group layers, where
+       ``cls`` is :class:`Layer`, :class:`ObjectGroup`,
+       :class:`ImageLayer`, or :class:`GroupLayer`; or :const:`None` if
+       they weren't read.
+    """
+
+    def __init__(self, version="1.0", tiledversion=None,
+                 orientation="orthogonal", renderorder="right-down", width=0,
+                 height=0, tilewidth=32, tileheight=32, infinite=False,
+                 tilesets=None, layers=None):
+        self.version = version
+        self.tiledversion = tiledversion
+        self.orientation = orientation
+        self.renderorder = renderorder
+        self.width = width
+        self.height = height
+        self.tilewidth = tilewidth
+        self.tileheight = tileheight
+        self.infinite = infinite
+        self.tilesets = tilesets
+        self.layers = layers
@@ -13,20 +13,44 @@
 # limitations under the License.
 
 
+import math
 import xml.etree.ElementTree as ET
 
 from . import local
+from .PackedPoints import PackedPoints
 from .Property import Property
 from .Text import Text
 
 
+# Attributes which determine the bounds of an object.
+_GEOMETRY = frozenset(["x", "y", "width", "height", "rotation", "gid",
+                       "polygon", "polyline"])
+
+
+def _geometry(name):
+    # Return a property for the attribute ``name``, which determines
+    # the bounds of the object, reporting changes to the object group
+    # containing it.  The value is stored in the instance dictionary
+    # under the same name, so pickled objects are unchanged.
+    def fget(self):
+        return self.__dict__[name]
+
+    def fset(self, value):
+        self.__dict__[name] = value
+        group = self.__dict__.get("_group")
+        if group is not None:
+            group._object_moved(self)
+
+    return property(fget, fset)
+
+
 class Object:
 
     """
     .. attribute:: id
 
-       Unique ID of the object as a string if set, or :const:`None`
-       otherwise.
+       Unique ID of the object if set, or :const:`None` otherwise.
+       See :meth:`TileMap.find_object`.
 
     .. attribute:: name
 
@@ -81,20 +105,32 @@ class Object:
 
        A list of coordinate pair tuples relative to the object's
        position indicating the points of the object's representation as
-       a polygon.  Set to :const:`None` to not represent the object as a
-       polygon.
+       a polygon.  This can also be a :class:`PackedPoints` object,
+       which stores the points far more compactly.  Set to
+       :const:`None` to not represent the object as a polygon.
 
     .. attribute:: polyline
 
        A list of coordinate pair tuples relative to the object's
        position indicating the points of the object's representation as
-       a polyline.  Set to :const:`None` to not represent the object as
-       a polyline.
+       a polyline.  This can also be a :class:`PackedPoints` object,
+       which stores the points far more compactly.  Set to
+       :const:`None` to not represent the object as a polyline.
 
     .. attribute:: text
 
        A :class:`Text` object indicating the object's representation as
        text.  Set to :const:`None` to not represent the object as text.
+
+    .. attribute:: bounds
+
+       The axis-aligned bounding box of the object as a tuple ``(x, y,
+       width, height)`` in pixels, taking :attr:`rotation`,
+       :attr:`polygon` and :attr:`polyline` points, and the bottom-left
+       origin of tile objects (objects with a :attr:`gid`) into
+       account.
+
+       (Read-only)
     """
 
     def __init__(self, name, type_, x, y, width=0, height=0, rotation=0,
@@ -116,15 +152,80 @@ class Object:
         self.polyline = polyline
         self.text = text
 
+    x = _geometry("x")
+    y = _geometry("y")
+    width = _geometry("width")
+    height = _geometry("height")
+    rotation = _geometry("rotation")
+    gid = _geometry("gid")
+    polygon = _geometry("polygon")
+    polyline = _geometry("polyline")
+
+    @property
+    def id(self):
+        return self.__dict__["id"]
+
+    @id.setter
+    def id(self, value):
+        old = self.__dict__.get("id")
+        self.__dict__["id"] = value
+        group = self.__dict__.get("_group")
+        if group is not None and value != old:
+            group._ids_changed([(value, self)], [(old, self)])
+
+    def __getstate__(self):
+        # The object group containing the object sets itself again
+        # when it is restored.
+        state = self.__dict__.copy()
+        state.pop("_group", None)
+        return state
+
+    @property
+    def bounds(self):
+        if self.polygon is not None:
+            points = self.polygon
+        elif self.polyline is not None:
+            points = self.polyline
+        elif self.gid is not None:
+            points = [(0, -self.height), (self.width, -self.height),
+                      (self.width, 0), (0, 0)]
+        else:
+            points = [(0, 0), (self.width, 0), (self.width, self.height),
+                      (0, self.height)]
+        if not points:
+            points = [(0, 0)]
+
+        if self.rotation:
+            # Objects rotate clockwise around their origin.
+            a = math.radians(self.rotation)
+            cos = math.cos(a)
+            sin = math.sin(a)
+            points = [(px * cos - py * sin, px * sin + py * cos)
+                      for px, py in points]
+
+        if isinstance(points, PackedPoints):
+            xs = points.data[0::2]
+            ys = points.data[1::2]
+        else:
+            xs = [px for px, py in points]
+            ys = [py for px, py in points]
+        x = self.x + min(xs)
+        y = self.y + min(ys)
+        return (x, y, max(xs) - min(xs), max(ys) - min(ys))
+
     @classmethod
-    def read_elem(cls, elem, fd):
+    def read_elem(cls, elem, fd, packed=False):
         """
         Read XML element ``elem`` and return an object of this class.
+        If ``packed`` is true, polygon and polyline points are read into
+        :class:`PackedPoints` objects.
 
         This is a low-level method used internally by this library; you
         don't typically need to use it.
         """
         id_ = elem.attrib.get("id")
+        if id_ is not None:
+            id_ = int(id_)
         name = elem.attrib.get("name", "")
         type_ = elem.attrib.get("type", "")
         x = int(elem.attrib.get("x", 0))
@@ -149,27 +250,11 @@ class Object:
             elif child.tag == "ellipse":
                 ellipse = True
             elif child.tag == "polygon":
-                s = child.attrib.get("points", "").strip()
-                polygon = []
-                for coord in s.split():
-                    pos = []
-                    for n in coord.aplit(','):
-                        if n.isdigit():
-                            pos.append(int(n))
-                        else:
-                            pos.append(float(n))
-                    polygon.append(tuple(pos))
+                polygon = local.read_points(child.attrib.get("points", ""),
+                                            packed)
             elif child.tag == "polyline":
-                s = child.attrib.get("points", "").strip()
-                polyline = []
-                for coord in s.split():
-                    pos = []
-                    for n in coord.aplit(','):
-                        if n.isdigit():
-                            pos.append(int(n))
-                        else:
-                            pos.append(float(n))
-                    polyline.append(tuple(pos))
+                polyline = local.read_points(child.attrib.get("points", ""),
+                                             packed)
             elif child.tag == "text":
                 text = Text.read_elem(child, fd)
 
@@ -198,11 +283,13 @@ class Object:
         if self.ellipse:
             elem.append(ET.Element("ellipse"))
         elif self.polygon is not None:
-            points = ' '.join(["{},{}".format(*T) for T in self.polygon])
-            elem.append(ET.Element("polygon", attrib={"points": points}))
+            points = ET.Element("polygon")
+            local.write_points(self.polygon, points)
+            elem.append(points)
         elif self.polyline is not None:
-            points = ' '.join(["{},{}".format(*T) for T in self.polyline])
-            elem.append(ET.Element("polyline", attrib={"points": points}))
+            points = ET.Element("polyline")
+            local.write_points(self.polyline, points)
+            elem.append(points)
         elif self.text:
             elem.append(self.text.get_elem(fd, encoding, compression,
                                            compressionlevel))
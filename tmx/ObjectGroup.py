@@ -13,11 +13,13 @@
 # limitations under the License.
 
 
+import math
 import xml.etree.ElementTree as ET
 
 from . import local
 from .Color import Color
 from .Object import Object
+from .PackedObjects import PackedObjects
 from .Property import Property
 
 
@@ -67,9 +69,31 @@ class ObjectGroup:
     .. attribute:: objects
 
        A list of :class:`Object` objects indicating the object group's
-       objects.
+       objects.  This can also be a :class:`PackedObjects` object,
+       which stores the objects far more compactly.
+
+       Objects are looked up by :meth:`query` and :meth:`objects_at`
+       through a spatial index, which is built the first time either
+       is called and kept up to date as objects are added to or
+       removed from this list and moved (by setting their attributes).
+       To make that possible, lists assigned to this attribute are
+       copied to a list which reports its changes to the object group,
+       so make changes through this attribute rather than through the
+       list which was assigned.  If the points of a polygon or
+       polyline are changed in place, assign them to the object again.
+       Objects stored in a :class:`PackedObjects` object aren't
+       indexed; their bounding boxes are checked in bulk by
+       :meth:`PackedObjects.overlapping` instead.
+
+    .. attribute:: index_cell_size
+
+       The size in pixels of the square cells of the spatial index
+       (see :attr:`objects`).  Changes take effect the next time the
+       index is used.
     """
 
+    index_cell_size = 256
+
     def __init__(self, name, color=None, opacity=1, visible=True, offsetx=0,
                  offsety=0, draworder=None, properties=None, objects=None,
                  id_=None):
@@ -81,13 +105,128 @@ class ObjectGroup:
         self.offsety = offsety
         self.draworder = draworder
         self.properties = properties or []
-        self.objects = objects or []
+        self.objects = objects if objects is not None else []
         self.id = id_
 
+    def __getstate__(self):
+        # The spatial index is rebuilt when needed rather than stored,
+        # and the map or group layer containing the object group sets
+        # itself again when it is restored.
+        state = self.__dict__.copy()
+        state["_index"] = None
+        state.pop("_parent", None)
+        return state
+
+    def __setstate__(self, state):
+        # States pickled before objects became a property store it
+        # under its own name.
+        state = state.copy()
+        objects = state.pop("_objects", state.pop("objects", None))
+        self.__dict__.update(state)
+        self.objects = objects
+
+    @property
+    def objects(self):
+        return self._objects
+
+    @objects.setter
+    def objects(self, value):
+        old = self.__dict__.get("_objects")
+        if isinstance(old, local.ObservedList):
+            old.callback = None
+            for obj in old:
+                if obj.__dict__.get("_group") is self:
+                    obj._group = None
+        elif isinstance(old, PackedObjects) and old._owner is self:
+            old._owner = None
+        if old is not None:
+            self._ids_changed([], self._object_ids())
+
+        if isinstance(value, PackedObjects):
+            value._owner = self
+        else:
+            value = local.ObservedList(value, self._objects_changed)
+            for obj in value:
+                obj._group = self
+        self._objects = value
+        self._index = None
+        self._ids_changed(self._object_ids(), [])
+
+    def query(self, x, y, width, height):
+        """
+        Return a list of the objects whose bounding boxes (see
+        :attr:`Object.bounds`) overlap the rectangle with its top-left
+        corner at ``(x, y)`` and the indicated size in pixels, in the
+        order they appear in :attr:`objects`.
+        """
+        if isinstance(self.objects, PackedObjects):
+            rows = self.objects.overlapping(x, y, width, height)
+            return [self.objects[row] for row in rows]
+        return self._get_index().query(x, y, x + width, y + height)
+
+    def objects_at(self, x, y):
+        """
+        Return a list of the objects whose bounding boxes (see
+        :attr:`Object.bounds`) contain the point ``(x, y)`` in pixels,
+        in the order they appear in :attr:`objects`.
+        """
+        return self.query(x, y, 0, 0)
+
+    def _get_index(self):
+        # Return the spatial index, building it if needed.
+        index = self._index
+        if index is None or index.cell_size != self.index_cell_size:
+            index = _ObjectIndex(self.objects, self.index_cell_size)
+            self._index = index
+        return index
+
+    def _objects_changed(self, added, removed, in_order):
+        # Called by the list of objects when it is changed.
+        self._ids_changed([(obj.id, obj) for obj in added],
+                          [(obj.id, obj) for obj in removed])
+        index = self._index
+        for obj in removed:
+            if obj.__dict__.get("_group") is self:
+                obj._group = None
+            if index is not None:
+                index.remove(obj)
+        for obj in added:
+            obj._group = self
+            if index is not None:
+                index.add(obj)
+        if index is not None and not in_order:
+            index.ordered = False
+
+    def _object_moved(self, obj):
+        # Called by objects in the group when their bounds may have
+        # changed.
+        if self._index is not None:
+            self._index.moved(obj)
+
+    def _ids_changed(self, added, removed):
+        # Called with lists of tuples (id, obj) of objects added to and
+        # removed from the group, or whose IDs changed, to keep the
+        # object ID index of the map containing the group up to date.
+        # ``obj`` is None for objects stored in a PackedObjects object.
+        parent = self.__dict__.get("_parent")
+        index = parent._get_id_index() if parent is not None else None
+        if index is not None:
+            index.update(self, added, removed)
+
+    def _object_ids(self):
+        # Return a list of tuples (id, obj) of the objects of the group
+        # as passed to _ids_changed().
+        if isinstance(self.objects, PackedObjects):
+            return [(id_, None) for id_ in self.objects.id if id_]
+        return [(obj.id, obj) for obj in self.objects]
+
     @classmethod
-    def read_elem(cls, elem, fd):
+    def read_elem(cls, elem, fd, packed=False, packed_objects=False):
         """
         Read XML element ``elem`` and return an object of this class.
+        If ``packed`` is true, the points of polygons and polylines are
+        read into :class:`PackedPoints` objects.  If ``packed_objects``
+        is true, objects are read into a :class:`PackedObjects` object.
 
         This is a low-level method used internally by this library; you
         don't typically need to use it.
@@ -103,14 +242,14 @@ class ObjectGroup:
         offsety = int(elem.attrib.get("offsety", 0))
         draworder = elem.attrib.get("draworder")
         properties = []
-        objects = []
+        objects = PackedObjects() if packed_objects else []
 
         for child in elem:
             if child.tag == "properties":
                 properties.extend(local.read_list_elem(child, "property",
                                                        Property, fd))
             elif child.tag == "object":
-                objects.append(Object.read_elem(child, fd))
+                objects.append(Object.read_elem(child, fd, packed))
 
         return cls(name, color, opacity, visible, offsetx, offsety, draworder,
                    properties, objects, id_)
@@ -139,3 +278,101 @@ class ObjectGroup:
                                      compressionlevel))
 
         return elem
+
+
+class _ObjectIndex:
+
+    # A uniform grid of the bounding boxes of the objects in a list,
+    # kept up to date by the object group as objects are added,
+    # removed, and moved.  Objects spanning too many cells are kept in a
+    # separate dictionary which is always searched.  Entries are tuples
+    # (obj, bounds, keys) by id(obj), and ``order`` gives the position
+    # of each object for sorting query results.  Objects added out of
+    # order make the index unordered until the positions are recounted.
+
+    max_cells = 64
+
+    def __init__(self, objects, cell_size):
+        self.objects = objects
+        self.cell_size = cell_size
+        self.cells = {}
+        self.large = {}
+        self.entries = {}
+        self.order = {}
+        self.seq = 0
+        self.ordered = True
+        for obj in objects:
+            self.add(obj)
+
+    def add(self, obj):
+        self.seq += 1
+        self.order[id(obj)] = self.seq
+        self._insert(obj)
+
+    def remove(self, obj):
+        entry = self.entries.pop(id(obj), None)
+        if entry is not None:
+            self._unlink(entry)
+            del self.order[id(obj)]
+
+    def moved(self, obj):
+        entry = self.entries.pop(id(obj), None)
+        if entry is not None:
+            self._unlink(entry)
+            self._insert(obj)
+
+    def query(self, x1, y1, x2, y2):
+        keys = self._keys(x1, y1, x2, y2)
+        if keys is None:
+            found = self.entries
+        else:
+            found = dict(self.large)
+            for key in keys:
+                found.update(self.cells.get(key, ()))
+
+        result = []
+        for entry in found.values():
+            bx1, by1, bx2, by2 = entry[1]
+            if bx1 <= x2 and x1 <= bx2 and by1 <= y2 and y1 <= by2:
+                result.append(entry[0])
+
+        if not self.ordered:
+            self.order = {id(obj): i for i, obj in enumerate(self.objects)}
+            self.seq = len(self.objects)
+            self.ordered = True
+        result.sort(key=lambda obj: self.order[id(obj)])
+        return result
+
+    def _insert(self, obj):
+        x, y, width, height = obj.bounds
+        bounds = (x, y, x + width, y + height)
+        keys = self._keys(*bounds)
+        entry = (obj, bounds, keys)
+        self.entries[id(obj)] = entry
+        if keys is None:
+            self.large[id(obj)] = entry
+        else:
+            for key in keys:
+                self.cells.setdefault(key, {})[id(obj)] = entry
+
+    def _unlink(self, entry):
+        obj, bounds, keys = entry
+        if keys is None:
+            del self.large[id(obj)]
+            return
+        for key in keys:
+            cell = self.cells[key]
+            del cell[id(obj)]
+            if not cell:
+                del self.cells[key]
+
+    def _keys(self, x1, y1, x2, y2):
+        size = self.cell_size
+        cx1 = math.floor(x1 / size)
+        cy1 = math.floor(y1 / size)
+        cx2 = math.floor(x2 / size)
+        cy2 = math.floor(y2 / size)
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > self.max_cells:
+            return None
+        return [(cx, cy) for cy in range(cy1, cy2 + 1)
+                for cx in range(cx1, cx2 + 1)]
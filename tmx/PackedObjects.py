@@ -0,0 +1,465 @@
+# Simple TMX library
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import array
+import collections.abc
+import sys
+
+from . import local
+from .Object import Object, _GEOMETRY
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class PackedObjects(collections.abc.MutableSequence):
+
+    """
+    A compact replacement for a list of :class:`Object` objects.
+    Rather than keeping one object per map object, the numeric
+    attributes of all objects are kept in parallel arrays (one column
+    per attribute), names and types are kept as interned strings, and
+    properties and shapes, which most objects don't have, are kept in
+    dictionaries indexed by position.  :class:`Object` objects are
+    created only when the objects are indexed or iterated over.
+
+    Objects of this class can be used anywhere a list of
+    :class:`Object` objects is expected, including
+    :attr:`ObjectGroup.objects`.  Any :class:`Object` objects can be
+    assigned to them.
+
+    Indexing returns a new object each time which reads and writes the
+    attributes stored at that position, so setting its attributes
+    modifies the stored object.  It refers to whatever object is at
+    that position, so don't keep it around while inserting or removing
+    objects before it; copy it (e.g. with :func:`copy.copy`) to get a
+    detached :class:`Object` instead.  The :attr:`Object.properties` of objects
+    without properties are an empty tuple; assign a list to add
+    properties to them.
+
+    The columns support the buffer protocol, so they can be filtered
+    in bulk without creating any objects, e.g. with
+    ``numpy.frombuffer(objects.x)``.
+
+    .. attribute:: id
+
+       An :class:`array.array` of the IDs of the objects, with ``0``
+       for objects without an ID.
+
+    .. attribute:: x
+    .. attribute:: y
+    .. attribute:: width
+    .. attribute:: height
+    .. attribute:: rotation
+
+       :class:`array.array` objects of the coordinates, sizes and
+       rotations of the objects as double precision floats.
+
+    .. attribute:: gid
+
+       An :class:`array.array` of the raw global tile IDs of the
+       objects' images, with ``0`` for objects without one.
+
+    .. attribute:: visible
+    .. attribute:: ellipse
+
+       :class:`array.array` objects of the visibility and ellipse flags
+       of the objects as ``0`` or ``1``.
+
+    .. attribute:: name
+    .. attribute:: type
+
+       Lists of the names and types of the objects.
+
+    .. attribute:: properties
+    .. attribute:: polygon
+    .. attribute:: polyline
+    .. attribute:: text
+
+       Dictionaries of the properties, polygon and polyline points, and
+       text of the objects which have any, by position.
+    """
+
+    def __init__(self, objects=()):
+        self.id = array.array("I")
+        self.x = array.array("d")
+        self.y = array.array("d")
+        self.width = array.array("d")
+        self.height = array.array("d")
+        self.rotation = array.array("d")
+        self.gid = array.array(local.GID_TYPECODE)
+        self.visible = array.array("B")
+        self.ellipse = array.array("B")
+        self.name = []
+        self.type = []
+        self.properties = {}
+        self.polygon = {}
+        self.polyline = {}
+        self.text = {}
+
+        # Bounding box columns (x1, y1, x2, y2) of the objects, built by
+        # overlapping() and kept up to date from then on.
+        self._bounds = None
+
+        # The positions of the objects by ID, built by _id_row() and
+        # dropped when objects are inserted or removed before others.
+        self._rows = None
+
+        # The object group whose objects these are, which is told about
+        # the IDs of objects added and removed; see ObjectGroup.
+        self._owner = None
+
+        self.extend(objects)
+
+    def __getstate__(self):
+        # The bounding boxes and positions are computed again when
+        # needed rather than stored, and the object group sets itself
+        # again when it is restored.
+        state = self.__dict__.copy()
+        state["_bounds"] = None
+        state["_rows"] = None
+        state["_owner"] = None
+        return state
+
+    def __setstate__(self, state):
+        self._rows = None
+        self._owner = None
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return type(self)([self[i] for i in range(len(self))[index]])
+        return _PackedObject(self, self._row(index))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            rows = range(len(self))[index]
+            value = [_row_values(obj) for obj in value]
+            if index.step not in (None, 1):
+                if len(value) != len(rows):
+                    e = ("attempt to assign sequence of size {} to extended "
+                         "slice of size {}".format(len(value), len(rows)))
+                    raise ValueError(e)
+                for row, values in zip(rows, value):
+                    self._store(row, values)
+                return
+            del self[index]
+            for i, values in enumerate(value):
+                self._insert(rows.start + i, values)
+        else:
+            self._store(self._row(index), _row_values(value))
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            for row in sorted(range(len(self))[index], reverse=True):
+                del self[row]
+            return
+
+        row = self._row(index)
+        id_ = self.id[row] or None
+        if self._rows is not None:
+            if row == len(self) - 1 and self._rows.get(id_) == row:
+                del self._rows[id_]
+            elif row < len(self) - 1:
+                self._rows = None
+        for name in _COLUMNS:
+            del getattr(self, name)[row]
+        if self._bounds is not None:
+            for column in self._bounds:
+                del column[row]
+        for name in _SIDE_TABLES:
+            table = getattr(self, name)
+            table.pop(row, None)
+            setattr(self, name, _shift(table, row + 1, -1))
+        self._ids_changed([], [id_])
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield _PackedObject(self, row)
+
+    def insert(self, index, value):
+        n = len(self)
+        if index < 0:
+            index = max(0, n + index)
+        self._insert(min(index, n), _row_values(value))
+
+    def append(self, value):
+        self._insert(len(self), _row_values(value))
+
+    def overlapping(self, x, y, width, height):
+        """
+        Return a list of the positions of the objects whose bounding
+        boxes (see :attr:`Object.bounds`) overlap the rectangle with
+        its top-left corner at ``(x, y)`` and the indicated size in
+        pixels, in ascending order.
+
+        The bounding boxes of all objects are computed the first time
+        this is called and kept up to date as objects are changed
+        through this object, so only the rectangle tests are done for
+        each call, with NumPy if it is available.  If the points of a
+        polygon or polyline are changed in place, assign them to the
+        object again.
+        """
+        x2 = x + width
+        y2 = y + height
+        if self._bounds is None:
+            self._bounds = tuple(array.array("d") for i in range(4))
+            for row in range(len(self)):
+                for column, value in zip(self._bounds, self._row_bounds(row)):
+                    column.append(value)
+
+        if numpy is not None:
+            bx1, by1, bx2, by2 = [numpy.frombuffer(column, dtype=numpy.float64)
+                                  for column in self._bounds]
+            mask = (bx1 <= x2) & (x <= bx2) & (by1 <= y2) & (y <= by2)
+            return numpy.flatnonzero(mask).tolist()
+
+        bx1, by1, bx2, by2 = self._bounds
+        return [row for row in range(len(self))
+                if (bx1[row] <= x2 and x <= bx2[row] and by1[row] <= y2 and
+                    y <= by2[row])]
+
+    def _id_row(self, id_):
+        # Return the position of the object with the ID ``id_``, or
+        # None if there is no such object.
+        if self._rows is None:
+            self._rows = {id_: row for row, id_ in enumerate(self.id)
+                          if id_}
+        return self._rows.get(id_)
+
+    def _set_id(self, row, id_):
+        # Set the ID of the object at position ``row`` to ``id_`` (0 for
+        # none).
+        old = self.id[row] or None
+        self.id[row] = id_
+        if self._rows is not None:
+            if self._rows.get(old) == row:
+                del self._rows[old]
+            if id_:
+                self._rows[id_] = row
+        if (id_ or None) != old:
+            self._ids_changed([id_ or None], [old])
+
+    def _ids_changed(self, added, removed):
+        # Tell the object group about the IDs of objects added and
+        # removed.
+        if self._owner is not None:
+            self._owner._ids_changed([(id_, None) for id_ in added],
+                                     [(id_, None) for id_ in removed])
+
+    def _row(self, index):
+        # Return the position ``index`` refers to, allowing negative
+        # indexes like lists do.
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("object index out of range")
+        return index
+
+    def _insert(self, row, values):
+        # Insert an object with the attribute values ``values`` (see
+        # _row_values()) at position ``row``.
+        if row < len(self):
+            for name in _SIDE_TABLES:
+                setattr(self, name, _shift(getattr(self, name), row, 1))
+            self._rows = None
+        columns, side = values
+        for name, value in zip(_COLUMNS, columns):
+            getattr(self, name).insert(row, value)
+        self._store_side(row, side)
+        if self._bounds is not None:
+            for column, value in zip(self._bounds, self._row_bounds(row)):
+                column.insert(row, value)
+        id_ = self.id[row]
+        if self._rows is not None and id_:
+            self._rows[id_] = row
+        self._ids_changed([id_ or None], [])
+
+    def _store(self, row, values):
+        # Replace the object at position ``row`` with one with the
+        # attribute values ``values``.
+        columns, side = values
+        self._set_id(row, columns[0])
+        for name, value in zip(_COLUMNS[1:], columns[1:]):
+            getattr(self, name)[row] = value
+        self._store_side(row, side)
+        self._moved(row)
+
+    def _store_side(self, row, side):
+        for name, value in zip(_SIDE_TABLES, side):
+            table = getattr(self, name)
+            if value is None:
+                table.pop(row, None)
+            else:
+                table[row] = value
+
+    def _moved(self, row):
+        # Update the bounding box of the object at position ``row``.
+        if self._bounds is not None:
+            for column, value in zip(self._bounds, self._row_bounds(row)):
+                column[row] = value
+
+    def _row_bounds(self, row):
+        # Return the bounding box of the object at position ``row`` as
+        # a tuple (x1, y1, x2, y2).
+        if (self.rotation[row] or row in self.polygon or
+                row in self.polyline):
+            x, y, width, height = _PackedObject(self, row).bounds
+        else:
+            x = self.x[row]
+            y = self.y[row]
+            width = self.width[row]
+            height = self.height[row]
+            # Tile objects have their origin at the bottom-left.
+            if self.gid[row]:
+                y -= height
+        return (x, y, x + width, y + height)
+
+
+def _row_values(obj):
+    # Return a tuple ``(columns, side)`` of the attribute values of the
+    # Object ``obj`` as stored in the columns and side tables of a
+    # PackedObjects object, in the order of _COLUMNS and _SIDE_TABLES.
+    columns = tuple(_CONVERTERS[name][0](getattr(obj, name))
+                    for name in _COLUMNS)
+    side = (obj.properties or None, obj.polygon, obj.polyline, obj.text)
+    return columns, side
+
+
+def _shift(table, row, delta):
+    # Return side table ``table`` with the positions from ``row`` on
+    # moved by ``delta``.
+    if not any(key >= row for key in table):
+        return table
+    return {(key + delta if key >= row else key): value
+            for key, value in table.items()}
+
+
+def _copy_object(obj):
+    # Return a copy of ``obj`` as an Object object.
+    return Object(*_object_args(obj))
+
+
+def _object_args(obj):
+    # Return the arguments to create a copy of ``obj`` with.
+    return (obj.name, obj.type, obj.x, obj.y, obj.width, obj.height,
+            obj.rotation, obj.gid, obj.visible, list(obj.properties),
+            obj.ellipse, obj.polygon, obj.polyline, obj.id, obj.text)
+
+
+def _intern(value):
+    # Names and types which aren't strings, such as None, are kept
+    # as-is.
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _optional(value):
+    return 0 if value is None else int(value)
+
+
+def _flag(value):
+    return int(bool(value))
+
+
+# Columns of PackedObjects objects, and the functions converting
+# Object attribute values to and from their column values.
+_CONVERTERS = {
+    "id": (_optional, lambda value: value or None),
+    "x": (float, local.number),
+    "y": (float, local.number),
+    "width": (float, local.number),
+    "height": (float, local.number),
+    "rotation": (float, float),
+    "gid": (_optional, lambda value: value or None),
+    "visible": (_flag, bool),
+    "ellipse": (_flag, bool),
+    "name": (_intern, lambda value: value),
+    "type": (_intern, lambda value: value),
+}
+_COLUMNS = tuple(_CONVERTERS)
+_SIDE_TABLES = ("properties", "polygon", "polyline", "text")
+
+
+def _column(name):
+    # Return a property for the attribute stored in column ``name``.
+    put, get = _CONVERTERS[name]
+
+    def fget(self):
+        return get(getattr(self._objects, name)[self._row])
+
+    def fset(self, value):
+        if name == "id":
+            self._objects._set_id(self._row, put(value))
+            return
+        getattr(self._objects, name)[self._row] = put(value)
+        if name in _GEOMETRY:
+            self._objects._moved(self._row)
+
+    return property(fget, fset)
+
+
+def _side_table(name, default):
+    # Return a property for the attribute stored in side table
+    # ``name``, which is ``default`` for objects not in the table.
+    def fget(self):
+        return getattr(self._objects, name).get(self._row, default)
+
+    def fset(self, value):
+        table = getattr(self._objects, name)
+        if value is None or (name == "properties" and not value):
+            table.pop(self._row, None)
+        else:
+            table[self._row] = value
+        if name in _GEOMETRY:
+            self._objects._moved(self._row)
+
+    return property(fget, fset)
+
+
+class _PackedObject(Object):
+
+    # An Object whose attributes are those of the object at position
+    # ``row`` of the PackedObjects object ``objects``.
+
+    def __init__(self, objects, row):
+        self._objects = objects
+        self._row = row
+
+    def __reduce__(self):
+        # Copies and pickles are Object objects detached from the
+        # PackedObjects object.
+        return (Object, _object_args(self))
+
+    id = _column("id")
+    x = _column("x")
+    y = _column("y")
+    width = _column("width")
+    height = _column("height")
+    rotation = _column("rotation")
+    gid = _column("gid")
+    visible = _column("visible")
+    ellipse = _column("ellipse")
+    name = _column("name")
+    type = _column("type")
+    properties = _side_table("properties", ())
+    polygon = _side_table("polygon", None)
+    polyline = _side_table("polyline", None)
+    text = _side_table("text", None)
@@ -0,0 +1,139 @@
+# Simple TMX library
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import array
+import collections.abc
+
+from . import local
+
+
+class PackedPoints(collections.abc.MutableSequence):
+
+    """
+    A compact replacement for a list of coordinate pair tuples, as
+    used by :attr:`Object.polygon` and :attr:`Object.polyline`.
+    Rather than keeping one tuple per point, the coordinates are kept
+    in a single buffer of floats, alternating between x and y.  Tuples
+    are created only when the points are indexed or iterated over.
+    Integral coordinates are returned as integers.
+
+    Objects of this class can be used anywhere a list of coordinate
+    pair tuples is expected.  Any pairs of numbers can be assigned to
+    them.
+
+    .. attribute:: data
+
+       The buffer holding the coordinates: the x and y coordinates of
+       the first point, followed by those of the second point, and so
+       on.  This is normally an :class:`array.array` of doubles, but it
+       can be any sequence of floats supporting the buffer protocol,
+       such as a :class:`memoryview` cast to ``"d"``.  It can be used
+       directly without copying, e.g. with
+       ``numpy.frombuffer(points.data).reshape(-1, 2)``.
+    """
+
+    def __init__(self, data=None):
+        if data is None:
+            data = array.array("d")
+        elif not isinstance(data, (array.array, memoryview)):
+            data = array.array("d", _flatten(data))
+        self.data = data
+
+    def __len__(self):
+        return len(self.data) // 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return type(self)(self.data[2 * start:2 * max(start, stop)])
+            return type(self)([self[i] for i in range(start, stop, step)])
+        i = 2 * self._index(index)
+        return (local.number(self.data[i]), local.number(self.data[i + 1]))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                self.data[2 * start:2 * stop] = array.array(
+                    "d", _flatten(value))
+                return
+            rows = range(start, stop, step)
+            value = list(value)
+            if len(value) != len(rows):
+                e = ("attempt to assign sequence of size {} to extended "
+                     "slice of size {}".format(len(value), len(rows)))
+                raise ValueError(e)
+            for i, point in zip(rows, value):
+                self[i] = point
+        else:
+            i = 2 * self._index(index)
+            x, y = value
+            self.data[i:i + 2] = array.array("d", (x, y))
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                del self.data[2 * start:2 * max(start, stop)]
+                return
+            for i in sorted(range(start, stop, step), reverse=True):
+                del self[i]
+        else:
+            i = 2 * self._index(index)
+            del self.data[i:i + 2]
+
+    def __iter__(self):
+        values = [local.number(n) for n in self.data]
+        return zip(values[0::2], values[1::2])
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.data)
+
+    def insert(self, index, value):
+        n = len(self)
+        if index < 0:
+            index = max(0, n + index)
+        i = 2 * min(index, n)
+        x, y = value
+        self.data[i:i] = array.array("d", (x, y))
+
+    def extend(self, values):
+        if isinstance(values, PackedPoints):
+            values = values.data
+        else:
+            values = _flatten(values)
+        self.data.extend(array.array("d", values))
+
+    def _index(self, index):
+        # Return the point index ``index`` refers to, allowing negative
+        # indexes like lists do.
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("point index out of range")
+        return index
+
+
+def _flatten(points):
+    # Return a list of the coordinates of the coordinate pairs
+    # ``points``, alternating between x and y.
+    values = []
+    for x, y in points:
+        values.append(x)
+        values.append(y)
+    return values
@@ -0,0 +1,101 @@
+# Simple TMX library
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import array
+import collections.abc
+
+from . import local
+from .LayerTile import LayerTile
+
+
+class PackedTiles(collections.abc.MutableSequence):
+
+    """
+    A compact replacement for a list of :class:`LayerTile` objects.
+    Rather than keeping one object per tile, the raw 32-bit global
+    tile IDs are kept in a single buffer with the flip flags still
+    packed into their high bits, exactly as they are stored in the TMX
+    file.  :class:`LayerTile` objects are created only when the tiles
+    are indexed or iterated over.
+
+    Objects of this class can be used anywhere a list of
+    :class:`LayerTile` objects is expected, including
+    :attr:`Layer.tiles` and :attr:`LayerChunk.tiles`.  Either
+    :class:`LayerTile` objects or raw integers can be assigned to them.
+
+    Note that indexing returns a new :class:`LayerTile` object each
+    time, so modifying the returned object does not modify the stored
+    tile; assign the modified object back to the index instead.
+
+    .. attribute:: data
+
+       The buffer holding the raw global tile IDs.  This is normally an
+       :class:`array.array` of unsigned 32-bit integers, but it can be
+       any sequence of integers supporting the buffer protocol, such as
+       a :class:`memoryview` cast to ``"I"``.  Read-only buffers result
+       in read-only tiles.
+    """
+
+    def __init__(self, data=None):
+        if data is None:
+            data = array.array(local.GID_TYPECODE)
+        elif not isinstance(data, (array.array, memoryview)):
+            data = array.array(local.GID_TYPECODE, [int(i) for i in data])
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return type(self)(self.data[index])
+        return LayerTile.from_int(self.data[index])
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self.data[index] = array.array(local.GID_TYPECODE,
+                                           [int(i) for i in value])
+        else:
+            self.data[index] = int(value)
+
+    def __delitem__(self, index):
+        del self.data[index]
+
+    def __iter__(self):
+        for n in self.data:
+            yield LayerTile.from_int(n)
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.data)
+
+    def insert(self, index, value):
+        self.data.insert(index, int(value))
+
+    def extend(self, values):
+        if isinstance(values, PackedTiles):
+            values = values.data
+        self.data.extend(array.array(local.GID_TYPECODE,
+                                     [int(i) for i in values]))
+
+    def split(self):
+        """
+        Return a tuple ``(gids, flags)`` of parallel arrays: the global
+        tile IDs with their flag bits cleared, and the flag bits of
+        each tile as a 4-bit value (8 for a horizontal flip, 4 for a
+        vertical flip, 2 for a diagonal flip, and 1 for a 120 degree
+        hexagonal rotation).  No :class:`LayerTile` objects are
+        created.  See :func:`tmx.local.split_gids` for details.
+        """
+        return local.split_gids(self.data)
@@ -112,22 +112,12 @@ class Tile:
         image = None
         animation = None
 
+        terrain = [None, None, None, None]
         if terrain_s:
             terrain_list = terrain_s.split(',')
-            terrain = [None, None, None, None]
             for i in range(len(terrain_list)):
-                if i < len(terrain):
-                    terrain[i] = terrain_list[i]
-
-            terrain_topleft = terrain[0]
-            terrain_topright = terrain[1]
-            terrain_bottomleft = terrain[2]
-            terrain_bottomright = terrain[3]
-        else:
-            terrain_topleft = None
-            terrain_topright = None
-            terrain_bottomleft = None
-            terrain_bottomright = None
+                if i < len(terrain) and terrain_list[i].strip():
+                    terrain[i] = int(terrain_list[i])
 
         for child in elem:
             if child.tag == "properties":
@@ -136,9 +126,9 @@ class Tile:
             elif child.tag == "image":
                 image = Image.read_elem(child, fd)
             elif child.tag == "animation":
-                animation = local.read_list_elem(child, "animation", Frame, fd)
+                animation = local.read_list_elem(child, "frame", Frame, fd)
 
-        return cls(id_, type_, terrain, probability, properties, image,
+        return cls(id_, type_, *terrain, probability, properties, image,
                    animation)
 
     def get_elem(self, fd, encoding, compression, compressionlevel):
@@ -148,8 +138,12 @@ class Tile:
         This is a low-level method used internally by this library; you
         don't typically need to use it.
         """
-        terrain = ','.join([self.terrain_topleft, self.terrain_topright,
-                            self.terrain_bottomleft, self.terrain_bottomright])
+        terrain = [self.terrain_topleft, self.terrain_topright,
+                   self.terrain_bottomleft, self.terrain_bottomright]
+        if any(i is not None for i in terrain):
+            terrain = ','.join("" if i is None else str(i) for i in terrain)
+        else:
+            terrain = None
         attr = {"id": self.id, "terrain": terrain,
                 "probability": self.probability}
         if self.type:
@@ -13,19 +13,159 @@
 # limitations under the License.
 
 
+import copyreg
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
 import xml.etree.ElementTree as ET
 
 from . import local
 from .Color import Color
 from .EditorSettings import EditorSettings
-from .GroupLayer import GroupLayer
+from .GroupLayer import GroupLayer, _update_layers
 from .ImageLayer import ImageLayer
 from .Layer import Layer
+from .LayerChunk import LayerChunk
+from .MapInfo import MapInfo
 from .ObjectGroup import ObjectGroup
 from .Property import Property
+from .PackedObjects import PackedObjects, _copy_object
+from .PackedPoints import PackedPoints
+from .PackedTiles import PackedTiles
 from .Tileset import Tileset
 
 
+# Snapshot files start with this magic string, followed by the format
+# version, the modification time and size of the TMX file the snapshot
+# was made from (zero if none), the length of the header, the pickled
+# header, and the pickled map.  The modification time and size are
+# kept at a fixed offset so they can be updated in place.  Bump the
+# version whenever the model changes in a way which makes old
+# snapshots unreadable.
+SNAPSHOT_MAGIC = b"TMXSNAP\0"
+SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct("<8sHqqI")
+_SNAPSHOT_STAMP = struct.Struct("<qq")
+_SNAPSHOT_STAMP_OFFSET = 10
+
+# Tile files start with this magic string, followed by the format
+# version, the number of tile grids, and a table giving the offset and
+# length in tiles of each grid.  Grids are raw little-endian unsigned
+# 32-bit global tile IDs.
+TILES_MAGIC = b"TMXTILE\0"
+TILES_VERSION = 1
+_TILES_HEADER = struct.Struct("<8sII")
+_TILES_ENTRY = struct.Struct("<QQ")
+
+
+def _gid_data(obj):
+    # Return the tiles of a Layer or LayerChunk object as an array of
+    # raw global tile IDs, decoding lazily loaded tile data without
+    # storing it.
+    if obj._tiles is None and obj._encoded is not None:
+        data, encoding, compression, level, packed = obj._encoded
+        return local.decode_tiles(data, encoding, compression, True).data
+
+    tiles = obj.tiles
+    if isinstance(tiles, PackedTiles):
+        return local.gid_array(tiles.data)
+    else:
+        return local.gid_array(tiles)
+
+
+def _tile_count(obj):
+    # Return the number of tiles a Layer or LayerChunk object should
+    # have, without decoding its tile data.
+    if isinstance(obj, Layer) and obj._tiles is not None and not obj._tiles:
+        return 0
+    return (obj.width or 0) * (obj.height or 0)
+
+
+def _reduce_tiles(obj):
+    # Pickle the tiles of Layer and LayerChunk objects as packed tile
+    # arrays.
+    state = obj.__getstate__()
+    state["_tiles"] = PackedTiles(_gid_data(obj))
+    state["_encoded"] = None
+    return (copyreg.__newobj__, (type(obj),), state)
+
+
+def _reduce_without_tiles(obj):
+    # Pickle Layer and LayerChunk objects without their tiles, which
+    # are mapped from a tile file when the snapshot is loaded.
+    state = obj.__getstate__()
+    state["_tiles"] = None
+    state["_encoded"] = None
+    return (copyreg.__newobj__, (type(obj),), state)
+
+
+def _map_tile_file(fname, counts):
+    # Memory-map the tile file ``fname`` and return a list of views of
+    # its tile grids, which must hold the numbers of tiles ``counts``.
+    with open(fname, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(buf)
+    if len(view) < _TILES_HEADER.size:
+        raise ValueError("Not a TMX tile file.")
+    magic, version, count = _TILES_HEADER.unpack_from(view)
+    if magic != TILES_MAGIC:
+        raise ValueError("Not a TMX tile file.")
+    if version != TILES_VERSION:
+        e = "Tile file version {} not supported.".format(version)
+        raise ValueError(e)
+    if count != len(counts):
+        e = "Tile file has {} tile grids, but the map has {}.".format(
+            count, len(counts))
+        raise ValueError(e)
+
+    grids = []
+    for i, expected in enumerate(counts):
+        offset, length = _TILES_ENTRY.unpack_from(
+            view, _TILES_HEADER.size + i * _TILES_ENTRY.size)
+        end = offset + length * 4
+        if end > len(view):
+            raise ValueError("Tile file is truncated.")
+        if length != expected:
+            e = "Tile grid {} has {} tiles, but should have {}.".format(
+                i, length, expected)
+            raise ValueError(e)
+        grid = view[offset:end].cast(local.GID_TYPECODE)
+        if sys.byteorder == "big":
+            grid = local.gid_array(grid)
+            grid.byteswap()
+        grids.append(grid)
+
+    return grids
+
+
+def _convert_points(points, packed):
+    # Return the points ``points`` as a PackedPoints object if
+    # ``packed`` is true, or as a list of tuples otherwise.
+    if points is None or isinstance(points, PackedPoints) == bool(packed):
+        return points
+    return PackedPoints(points) if packed else list(points)
+
+
+def _file_digest(fname):
+    # Return the SHA-256 digest of the contents of the file ``fname``.
+    h = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _file_stamp(fname):
+    # Return the modification time and size of the file ``fname``.
+    st = os.stat(fname)
+    return (st.st_mtime_ns, st.st_size)
+
+
 class TileMap:
 
     """
@@ -54,7 +194,9 @@ class TileMap:
     .. attribute:: compressionlevel
 
        The compression level to use for the tile layer data, or
-       :const:`None` to use the algorithm default.
+       :const:`None` to use the algorithm default.  This can be
+       overridden when saving with the ``data_compressionlevel``
+       argument of :meth:`save`.
 
     .. attribute:: width
 
@@ -102,7 +244,7 @@ class TileMap:
     .. attribute:: nextobjectid
 
        The next available ID for new objects.  Set to :const:`None` to
-       not set it.
+       not set it.  See :meth:`new_object_id`.
 
     .. attribute:: editorsettings
 
@@ -126,6 +268,11 @@ class TileMap:
        layers, respectively.  Those that appear in this list first are
        rendered first (i.e. furthest in the back).
 
+       To keep the object ID index (see :meth:`find_object`) up to
+       date, lists assigned to this attribute are copied to a list
+       which reports its changes to the map, so make changes through
+       this attribute rather than through the list which was assigned.
+
     .. attribute:: layers_list
 
        :attr:`layers`, but with all :class:`GroupLayer` objects
@@ -165,28 +312,682 @@ class TileMap:
         self.backgroundcolor = None
         self.nextlayerid = None
         self.nextobjectid = None
-        self.editorsetttings = EditorSettings()
+        self.editorsettings = EditorSettings()
         self.properties = []
         self.tilesets = []
+        self._object_index = None
         self.layers = []
 
+    def __getstate__(self):
+        # The object ID index is rebuilt when needed rather than stored.
+        state = self.__dict__.copy()
+        state["_object_index"] = None
+        return state
+
+    def __setstate__(self, state):
+        # States pickled before layers became a property store it
+        # under its own name.
+        state = state.copy()
+        layers = state.pop("_layers", state.pop("layers", None))
+        self.__dict__.update(state)
+        self.layers = layers
+
+    @property
+    def layers(self):
+        return self._layers
+
+    @layers.setter
+    def layers(self, value):
+        old = self.__dict__.get("_layers")
+        if old is not None:
+            old.callback = None
+            _update_layers(self, [], old)
+        self._layers = local.ObservedList(value, self._layers_changed)
+        _update_layers(self, self._layers, [])
+
+    def _layers_changed(self, added, removed, in_order):
+        # Called by the list of layers when it is changed.
+        _update_layers(self, added, removed)
+
     @classmethod
-    def load(cls, fname):
+    def load(cls, fname, packed=False, lazy=False, workers=None,
+             layer_names=None, layer_types=None, layer_filter=None,
+             tileset_names=None, cache=None, base_dir=None,
+             resolver=None, file_compression=None, chunk_budget=None,
+             packed_objects=False):
         """
-        Load the TMX file with the indicated name and return a
-        :class:`TileMap` object representing it.
+        Load a TMX file and return a :class:`TileMap` object
+        representing it.  ``fname`` can be the name of the file, a
+        bytes-like object holding its contents, or a binary file
+        object to read it from.
+
+        Arguments:
+
+        - ``packed`` -- Whether or not to store the tiles of layers and
+          chunks in :class:`PackedTiles` objects instead of lists of
+          :class:`LayerTile` objects, and the points of polygons and
+          polylines in :class:`PackedPoints` objects instead of lists
+          of tuples.  This uses far less memory for large layers and
+          polygons.  Points are packed along with tiles rather than
+          objects because, like tiles, they are plain values which
+          read the same either way, while :class:`PackedObjects`
+          changes how objects themselves are stored.
+        - ``lazy`` -- Whether or not to defer decoding the tile data of
+          layers and chunks until their ``tiles`` attribute is first
+          accessed.  Layers and chunks that are never accessed are
+          never decoded, and are written back unchanged when saved
+          with the same encoding, compression, and compression level.
+        - ``workers`` -- The number of threads to decompress and decode
+          the tile data of layers and chunks with.  Set to
+          :const:`None` or less than 2 to decode everything in the
+          calling thread.  Ignored if ``lazy`` is true.
+        - ``layer_names`` -- A collection of names of the layers to
+          load, or :const:`None` to not filter layers by name.
+        - ``layer_types`` -- A collection of the classes of layers to
+          load (any of :class:`Layer`, :class:`ObjectGroup`, and
+          :class:`ImageLayer`), or :const:`None` to not filter layers
+          by type.
+        - ``layer_filter`` -- A function which is passed the path of
+          each layer as a tuple of names (the names of the group
+          layers containing it, outermost first, followed by the name
+          of the layer itself) and returns whether or not to load the
+          layer, or :const:`None` to not filter layers this way.
+        - ``tileset_names`` -- A collection of names of the tilesets to
+          load, or :const:`None` to load all tilesets.
+        - ``cache`` -- The name of a directory to keep snapshots (see
+          :meth:`save_snapshot`) of loaded maps in, or :const:`None` to
+          not use a cache.  If the directory has an up-to-date snapshot
+          of the file, the snapshot is loaded instead of the file,
+          which is much faster; otherwise, the file is loaded and a new
+          snapshot is saved.  A snapshot is up-to-date if neither the
+          file nor any external tilesets it uses have been modified
+          since the snapshot was saved, as determined by their
+          modification times and sizes, or by the file's contents if
+          only its modification time changed.  The cache is only used
+          when ``fname`` is a file name and no filters or ``resolver``
+          are given.  Since snapshots are based on :mod:`pickle`,
+          loading one can run arbitrary code: never use a cache
+          directory which anyone you don't trust can write to.
+        - ``base_dir`` -- The directory relative paths of external
+          files, such as tilesets and images, are relative to, or
+          :const:`None` to use the directory containing the file if
+          ``fname`` is a file name, or the current directory otherwise.
+        - ``resolver`` -- A function which is passed the path of each
+          external tileset (relative paths joined to ``base_dir``) and
+          returns the tileset's contents as a bytes-like object, a
+          binary file object, or the name of a file to read instead,
+          or :const:`None` to read external tilesets from their paths.
+          Tilesets read this way are not cached (see
+          :attr:`Tileset.cache_size`).
+        - ``file_compression`` -- The compression method of the file
+          itself: ``"gzip"``, ``"zstd"``, or :const:`False` for an
+          uncompressed file.  Set to :const:`None` to choose by the
+          suffix of ``fname`` if it is a file name (``.gz`` for gzip,
+          ``.zst`` for zstd, and uncompressed otherwise).  Compressed
+          files are decompressed incrementally as they are parsed.
+          ``"zstd"`` requires the :mod:`compression.zstd` module or the
+          zstandard package.
+        - ``chunk_budget`` -- The maximum number of chunks to keep the
+          tiles of in memory at a time, or :const:`None` for no limit.
+          If this is set, all tile data is loaded lazily, as if
+          ``lazy`` is true, and once more chunks than this have been
+          accessed, the tiles of the least recently accessed chunks are
+          dropped from memory.  Unchanged chunks go back to their
+          encoded data, and changed chunks are written to a temporary
+          scratch file and read back from it when they are next
+          accessed.  Memory use then depends on the chunks in use
+          rather than the size of the map.  Maps loaded from the
+          snapshot cache start with all chunks in memory; they are
+          paged out gradually as other chunks are accessed.
+        - ``packed_objects`` -- Whether or not to store the objects of
+          object groups in :class:`PackedObjects` objects instead of
+          lists of :class:`Object` objects.  This uses far less memory
+          for large object groups.
+
+        Layers which don't pass all of the layer filters are skipped
+        entirely; their data is never decoded.  Group layers are
+        loaded only if at least one of the layers inside of them is,
+        unless no layer filters are given.  Note that saving a map
+        loaded with filters only saves what was loaded.
         """
+        filtered = (layer_names is not None or layer_types is not None or
+                    layer_filter is not None)
+
+        source, fd = local.xml_source(fname, base_dir)
+        if file_compression is None:
+            file_compression = local.guess_file_compression(fname)
+
+        snapshot = None
+        if (cache is not None and source is fname and resolver is None and
+                not filtered and tileset_names is None):
+            key = os.path.realpath(fname).encode("utf-8")
+            snapshot = os.path.join(
+                cache, hashlib.sha256(key).hexdigest() + ".snapshot")
+            self = cls._load_cached(snapshot, fname, packed, packed_objects)
+            if self is not None:
+                if chunk_budget is not None:
+                    self._page_chunks(chunk_budget)
+                return self
+            stamp = _file_stamp(fname)
+            header = {"digest": _file_digest(fname)}
+
         self = cls()
+        parallel = workers is not None and workers >= 2 and not lazy
+        lazy = lazy or parallel or chunk_budget is not None
+
+        # The file is parsed incrementally.  Each layer, object group,
+        # image layer, and tileset is read as soon as its element is
+        # closed, and the element is then discarded, so the full XML
+        # tree never has to be kept in memory.
+        layer_classes = {"layer": Layer, "objectgroup": ObjectGroup,
+                         "imagelayer": ImageLayer}
+
+        def wanted(elem, cls):
+            name = elem.attrib.get("name", "")
+            if layer_names is not None and name not in layer_names:
+                return False
+            if layer_types is not None and cls not in layer_types:
+                return False
+            if layer_filter is not None:
+                path = tuple(group_names) + (name,)
+                if not layer_filter(path):
+                    return False
+            return True
+
+        elems = []
+        layer_lists = []
+        group_names = []
+        with local.open_file(source, "rb", file_compression) as f:
+            for event, elem in ET.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    if not elems:
+                        self._read_attrib(elem)
+                        layer_lists.append(self.layers)
+                    elif (elem.tag == "group" and
+                          elems[-1].tag in ("map", "group")):
+                        layer_lists.append([])
+                        group_names.append(elem.attrib.get("name", ""))
+                    elems.append(elem)
+                    continue
+
+                elems.pop()
+                if not elems or elems[-1].tag not in ("map", "group"):
+                    continue
+                parent = elems[-1]
+
+                if elem.tag in layer_classes:
+                    layer_cls = layer_classes[elem.tag]
+                    if wanted(elem, layer_cls):
+                        if layer_cls is Layer:
+                            layer = Layer.read_elem(elem, fd, packed, lazy,
+                                                    self.compressionlevel)
+                        elif layer_cls is ObjectGroup:
+                            layer = ObjectGroup.read_elem(elem, fd, packed,
+                                                          packed_objects)
+                        else:
+                            layer = layer_cls.read_elem(elem, fd)
+                        layer_lists[-1].append(layer)
+                elif elem.tag == "group":
+                    # Child layers have already been read and discarded.
+                    layers = layer_lists.pop()
+                    group_names.pop()
+                    if layers or not filtered:
+                        layer = GroupLayer.read_elem(elem, fd, packed, lazy)
+                        layer.layers = layers
+                        layer_lists[-1].append(layer)
+                elif parent.tag != "map":
+                    # Group properties are read along with the group.
+                    continue
+                elif elem.tag == "editorsettings":
+                    self.editorsettings = EditorSettings.read_elem(elem, fd)
+                elif elem.tag == "properties":
+                    self.properties.extend(local.read_list_elem(
+                        elem, "property", Property, fd))
+                elif elem.tag == "tileset":
+                    # The names of external tilesets are only known once
+                    # their TSX files have been read.
+                    name = elem.attrib.get("name")
+                    if (tileset_names is None or name is None or
+                            name in tileset_names):
+                        tileset = Tileset.read_elem(elem, fd, resolver)
+                        if (tileset_names is None or
+                                tileset.name in tileset_names):
+                            self.tilesets.append(tileset)
+
+                elem.clear()
+                parent.remove(elem)
+
+        if chunk_budget is not None:
+            self._page_chunks(chunk_budget)
+
+        if parallel:
+            objects = self._tile_owners()
+            if chunk_budget is not None:
+                objects = [obj for obj in objects if isinstance(obj, Layer)]
+            local.decode_parallel(objects, workers)
+
+        if snapshot is not None:
+            sources = [tileset.source for tileset in self.tilesets
+                       if tileset.source]
+            header["deps"] = [(source, _file_stamp(source))
+                              for source in sources]
+            os.makedirs(cache, exist_ok=True)
+            self._write_snapshot(snapshot, header, stamp)
+
+        return self
+
+    @classmethod
+    def load_snapshot(cls, fname, packed=False, packed_objects=False,
+                      tiles=None):
+        """
+        Load the snapshot file with the indicated name (see
+        :meth:`save_snapshot`) and return a :class:`TileMap` object
+        representing it.
+
+        Arguments:
+
+        - ``packed`` -- Whether or not to store the tiles of layers and
+          chunks in :class:`PackedTiles` objects instead of lists of
+          :class:`LayerTile` objects, and the points of polygons and
+          polylines in :class:`PackedPoints` objects instead of lists
+          of tuples, as in :meth:`load`.  Loading is fastest with
+          packed tiles, since that is how they are stored in the
+          snapshot.
+        - ``packed_objects`` -- Whether or not to store the objects of
+          object groups in :class:`PackedObjects` objects instead of
+          lists of :class:`Object` objects.
+        - ``tiles`` -- The name of the tile file the snapshot's tiles
+          were saved to (see :meth:`save_snapshot`), or :const:`None`
+          if they were saved in the snapshot itself.  The tile file is
+          memory-mapped as in :meth:`map_tiles`, so neither a TMX file
+          is parsed nor any tiles unpickled, and the time this takes
+          depends only on the rest of the map.  Pass ``packed=True`` to
+          keep the mapped tiles; otherwise they are copied into lists.
+
+        A :exc:`ValueError` is raised if ``tiles`` is given for a
+        snapshot holding its own tiles or vice versa, or if the tile
+        file doesn't match the snapshot.
+        """
+        with open(fname, "rb") as f:
+            stamp, header = cls._read_snapshot_header(f)
+            counts = header.get("tiles")
+            if counts is None and tiles is not None:
+                raise ValueError("Snapshot has no separate tile file.")
+            if counts is not None and tiles is None:
+                raise ValueError("Snapshot tiles are in a separate file.")
+            if counts is not None:
+                grids = _map_tile_file(tiles, counts)
+            self = pickle.load(f)
+
+        if counts is not None:
+            for obj, grid in zip(self._tile_owners(), grids):
+                obj.tiles = PackedTiles(grid)
+        if not packed:
+            self._unpack_tiles()
+        self._pack_objects(packed, packed_objects)
+
+        return self
+
+    def save_snapshot(self, fname, tiles=None):
+        """
+        Save the object to a snapshot file with the indicated name.
+
+        Snapshots are a versioned binary format storing the map's tile
+        data as packed arrays of global tile IDs along with the rest of
+        the map, and can be loaded with :meth:`load_snapshot` far
+        faster than TMX files can be loaded.  They are meant to be used
+        as caches: they can only be read by the same version of this
+        library, and since they are based on :mod:`pickle`, they must
+        never be loaded from untrusted sources.
+
+        If ``tiles`` is given, the map's tiles are saved to a tile file
+        with that name instead (see :meth:`export_tiles`), and the
+        snapshot holds only the rest of the map.  Loading it with
+        :meth:`load_snapshot` then maps the tiles from the tile file
+        rather than reading them, which is the fastest way to reopen a
+        big map.  The two files must be kept together.
+        """
+        if tiles is None:
+            self._write_snapshot(fname, {})
+        else:
+            counts = self._export_tiles(tiles)
+            self._write_snapshot(fname, {"tiles": counts},
+                                 reduce=_reduce_without_tiles)
 
-        tree = ET.parse(fname)
-        root = tree.getroot()
-        fd = os.path.dirname(fname)
+    def export_tiles(self, fname):
+        """
+        Save the tiles of all of the map's tile layers and chunks to a
+        flat binary tile file with the indicated name, to be used with
+        :meth:`map_tiles`.  The file holds a small header followed by
+        the raw global tile IDs of each layer and chunk, in document
+        order.
+        """
+        self._export_tiles(fname)
+
+    def _export_tiles(self, fname):
+        # Save the tile file ``fname`` (see export_tiles()) and return
+        # a list of the number of tiles in each grid.
+        grids = [_gid_data(obj) for obj in self._tile_owners()]
+
+        offset = _TILES_HEADER.size + _TILES_ENTRY.size * len(grids)
+        entries = []
+        for grid in grids:
+            entries.append(_TILES_ENTRY.pack(offset, len(grid)))
+            offset += len(grid) * grid.itemsize
+
+        with open(fname, "wb") as f:
+            f.write(_TILES_HEADER.pack(TILES_MAGIC, TILES_VERSION,
+                                       len(grids)))
+            f.write(b"".join(entries))
+            for grid in grids:
+                if sys.byteorder == "big":
+                    grid = grid[:]
+                    grid.byteswap()
+                f.write(grid.tobytes())
+
+        return [len(grid) for grid in grids]
+
+    def map_tiles(self, fname):
+        """
+        Replace the tiles of all of the map's tile layers and chunks
+        with read-only :class:`PackedTiles` views of a tile file saved
+        by :meth:`export_tiles`.  The file is memory-mapped rather than
+        read, so this takes the same short time regardless of the size
+        of the map, and processes mapping the same file share a single
+        copy of the tiles in memory.  Tiles which are modified must be
+        replaced with new lists or :class:`PackedTiles` objects first.
+
+        The tile file must have been exported from the same map; to
+        avoid decoding the tiles of the TMX file only to replace them,
+        load it with ``lazy=True``.  Note that only the tiles are
+        mapped: the rest of the map still has to be loaded from the
+        TMX file first, so while no tile data is decoded, loading time
+        still grows with the size of the file.  To avoid that, save a
+        snapshot with its tiles in a tile file (see
+        :meth:`save_snapshot`) and reopen the map from both with
+        :meth:`load_snapshot`.  On big-endian systems, the tiles are
+        copied instead of mapped.
+
+        A :exc:`ValueError` is raised if the file is not a tile file
+        or does not match the map, i.e. if it has a different number of
+        tile grids than the map has tile layers and chunks, or if any
+        grid has a different number of tiles than its layer or chunk
+        (``width * height``, or none for layers without tile data).
+        The map is left unchanged in that case.
+        """
+        objects = self._tile_owners()
+        grids = _map_tile_file(fname, [_tile_count(obj) for obj in objects])
+        for obj, grid in zip(objects, grids):
+            obj.tiles = PackedTiles(grid)
+
+    def region(self, x, y, width, height, visible_only=False):
+        """
+        Return a list of tuples ``(layer, tiles)`` for each tile layer
+        in :attr:`layers_list`, where ``tiles`` is the rectangle of the
+        layer's tiles returned by :meth:`Layer.region`.
+
+        If ``visible_only`` is true, layers which are not visible
+        themselves or are inside of a group layer which is not visible
+        are skipped.
+        """
+        def visible_layers(layers):
+            for layer in layers:
+                if visible_only and not layer.visible:
+                    continue
+                if isinstance(layer, GroupLayer):
+                    yield from visible_layers(layer.layers)
+                elif isinstance(layer, Layer):
+                    yield layer
+
+        return [(layer, layer.region(x, y, width, height))
+                for layer in visible_layers(self.layers)]
+
+    def find_object(self, id_):
+        """
+        Return a tuple ``(obj, group)`` of the object with the ID
+        ``id_`` and the :class:`ObjectGroup` in :attr:`layers_list`
+        containing it, or :const:`None` if there is no such object.
+
+        Objects are looked up through an index by ID, which is built
+        the first time this method or :meth:`new_object_id` is called
+        and kept up to date from then on as layers and objects are
+        added, removed, or given new IDs through :attr:`layers`,
+        :attr:`GroupLayer.layers`, :attr:`ObjectGroup.objects`, and
+        :attr:`Object.id`, so each call takes constant time.
+        """
+        return self._get_id_index(True).find(id_)
+
+    def new_object_id(self):
+        """
+        Return a new unique object ID and advance :attr:`nextobjectid`
+        past it.  The ID is :attr:`nextobjectid`, or one higher than
+        the highest ID any of the map's objects has had since the
+        index was built (see :meth:`find_object`) if that is higher or
+        :attr:`nextobjectid` is :const:`None`.
+        """
+        index = self._get_id_index(True)
+        id_ = max(self.nextobjectid or 1, index.max_id + 1)
+        self.nextobjectid = id_ + 1
+        return id_
+
+    def _get_id_index(self, build=False):
+        # Return the object ID index, building it first if ``build`` is
+        # true, or None if it hasn't been built.
+        if self._object_index is None and build:
+            self._object_index = _ObjectIdIndex(self.layers)
+        return self._object_index
+
+    @classmethod
+    def _load_cached(cls, snapshot, fname, packed, packed_objects):
+        # Return the map stored in the snapshot file ``snapshot`` if it
+        # is up-to-date with the TMX file ``fname``, or None otherwise.
+        try:
+            with open(snapshot, "rb") as f:
+                stamp, header = cls._read_snapshot_header(f)
+                current = _file_stamp(fname)
+                touched = current != stamp
+                if touched and (current[1] != stamp[1] or
+                                _file_digest(fname) != header["digest"]):
+                    return None
+                for source, dep_stamp in header["deps"]:
+                    if _file_stamp(source) != dep_stamp:
+                        return None
+                self = pickle.load(f)
+        except Exception:
+            # Missing, corrupt, or incompatible snapshots are simply
+            # replaced.
+            return None
+
+        if touched:
+            # The file's contents are unchanged, so record its new
+            # modification time to avoid hashing it on every load.
+            try:
+                with open(snapshot, "r+b") as f:
+                    f.seek(_SNAPSHOT_STAMP_OFFSET)
+                    f.write(_SNAPSHOT_STAMP.pack(*current))
+            except OSError:
+                pass
+
+        if not packed:
+            self._unpack_tiles()
+        self._pack_objects(packed, packed_objects)
+
+        return self
+
+    @staticmethod
+    def _read_snapshot_header(f):
+        # Read the start of the snapshot file object ``f`` and return a
+        # tuple ``(stamp, header)`` of the modification time and size
+        # of its TMX file and its header.
+        data = f.read(_SNAPSHOT_HEADER.size)
+        if len(data) < _SNAPSHOT_HEADER.size:
+            raise ValueError("Not a TMX snapshot file.")
+        magic, version, mtime, fsize, size = _SNAPSHOT_HEADER.unpack(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Not a TMX snapshot file.")
+        if version != SNAPSHOT_VERSION:
+            e = "Snapshot version {} not supported.".format(version)
+            raise ValueError(e)
+        return (mtime, fsize), pickle.loads(f.read(size))
+
+    def _write_snapshot(self, fname, header, stamp=(0, 0),
+                        reduce=_reduce_tiles):
+        # Save the object to the snapshot file ``fname`` with header
+        # ``header`` and TMX file modification time and size ``stamp``,
+        # pickling Layer and LayerChunk objects with ``reduce``.  The
+        # file is replaced atomically.
+        header = pickle.dumps(header, pickle.HIGHEST_PROTOCOL)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fname) or os.curdir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC,
+                                              SNAPSHOT_VERSION, *stamp,
+                                              len(header)))
+                f.write(header)
+                pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+                pickler.dispatch_table = copyreg.dispatch_table.copy()
+                pickler.dispatch_table[Layer] = reduce
+                pickler.dispatch_table[LayerChunk] = reduce
+                pickler.dump(self)
+            os.replace(tmp, fname)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def _page_chunks(self, budget):
+        # Page the tiles of all chunks of the map through a new
+        # ChunkPager with the indicated budget.  Chunks which are
+        # already in memory are only paged out as others are accessed.
+        pager = local.ChunkPager(budget)
+        for obj in self._tile_owners():
+            if isinstance(obj, LayerChunk):
+                obj._pager = pager
+                if obj._tiles is not None:
+                    pager.adopt(obj)
+
+    def _unpack_tiles(self):
+        # Replace all PackedTiles objects with lists of LayerTile
+        # objects.
+        for obj in self._tile_owners():
+            if isinstance(obj.tiles, PackedTiles):
+                obj.tiles = list(obj.tiles)
+
+    def _pack_objects(self, packed, packed_objects):
+        # Store the points of all polygons and polylines in PackedPoints
+        # objects if ``packed`` is true, or in lists of tuples
+        # otherwise, and the objects of all object groups in
+        # PackedObjects objects if ``packed_objects`` is true, or in
+        # lists of Object objects otherwise.
+        for layer in self.layers_list:
+            if not isinstance(layer, ObjectGroup):
+                continue
+            objects = layer.objects
+            if packed_objects and not isinstance(objects, PackedObjects):
+                objects = PackedObjects(objects)
+                layer.objects = objects
+            elif not packed_objects and isinstance(objects, PackedObjects):
+                objects = [_copy_object(obj) for obj in objects]
+                layer.objects = objects
+
+            if isinstance(objects, PackedObjects):
+                for table in (objects.polygon, objects.polyline):
+                    for row, points in table.items():
+                        table[row] = _convert_points(points, packed)
+            else:
+                for obj in objects:
+                    obj.polygon = _convert_points(obj.polygon, packed)
+                    obj.polyline = _convert_points(obj.polyline, packed)
+
+    def _tile_owners(self):
+        # Return a list of all Layer and LayerChunk objects of the map
+        # in document order.
+        objects = []
+        for layer in self.layers_list:
+            if isinstance(layer, Layer):
+                objects.append(layer)
+                objects.extend(layer.chunks)
+        return objects
+
+    @classmethod
+    def probe(cls, fname, tilesets=True, layers=True, base_dir=None,
+              resolver=None, file_compression=None):
+        """
+        Quickly read a summary of a TMX file and return a
+        :class:`MapInfo` object describing it.  ``fname`` can be
+        anything accepted by :meth:`load`.
+
+        Only the start tags of the file are examined; no tile data is
+        decoded and no objects other than the summary are created.
+        Reading stops as soon as everything requested has been found.
+
+        Arguments:
+
+        - ``tilesets`` -- Whether or not to read the names of the
+          map's tilesets.  The start tags of external tilesets are read
+          to find their names.
+        - ``layers`` -- Whether or not to read the names and types of
+          the map's layers.  If this is false, reading stops at the
+          first layer.
+        - ``base_dir``, ``resolver``, ``file_compression`` -- As for
+          :meth:`load`.
+        """
+        info = MapInfo()
+        source, fd = local.xml_source(fname, base_dir)
+        if file_compression is None:
+            file_compression = local.guess_file_compression(fname)
+        if tilesets:
+            info.tilesets = []
+        if layers:
+            info.layers = []
+        layer_classes = {"layer": Layer, "objectgroup": ObjectGroup,
+                         "imagelayer": ImageLayer, "group": GroupLayer}
+
+        with local.open_file(source, "rb", file_compression) as f:
+            for tag, attrib, parent in local.iter_start_tags(f):
+                if parent is None:
+                    info.version = attrib.get("version", info.version)
+                    info.tiledversion = attrib.get("tiledversion")
+                    info.orientation = attrib.get("orientation",
+                                                  info.orientation)
+                    info.renderorder = attrib.get("renderorder",
+                                                  info.renderorder)
+                    info.width = int(attrib.get("width", info.width))
+                    info.height = int(attrib.get("height", info.height))
+                    info.tilewidth = int(attrib.get("tilewidth",
+                                                    info.tilewidth))
+                    info.tileheight = int(attrib.get("tileheight",
+                                                     info.tileheight))
+                    info.infinite = bool(int(attrib.get("infinite", False)))
+                    if not tilesets and not layers:
+                        break
+                elif parent not in ("map", "group"):
+                    continue
+                elif tag in layer_classes:
+                    if not layers:
+                        break
+                    info.layers.append((layer_classes[tag],
+                                        attrib.get("name", "")))
+                elif tag == "tileset" and tilesets:
+                    tsx = attrib.get("source")
+                    if tsx is not None:
+                        tsx = os.path.join(fd, tsx)
+                        if resolver is not None:
+                            tsx = resolver(tsx)
+                        attrib = local.read_root_attrib(tsx)
+                    info.tilesets.append(attrib.get("name", ""))
+
+        return info
+
+    def _read_attrib(self, root):
+        # Read the attributes of the <map> element ``root``.
         self.version = root.attrib.get("version", self.version)
         self.tiledversion = root.attrib.get("tiledversion", self.tiledversion)
         self.orientation = root.attrib.get("orientation", self.orientation)
         self.renderorder = root.attrib.get("renderorder", self.renderorder)
         self.compressionlevel = root.attrib.get("compressionlevel",
                                                 self.compressionlevel)
+        if self.compressionlevel is not None:
+            self.compressionlevel = int(self.compressionlevel)
         self.width = int(root.attrib.get("width", self.width))
         self.height = int(root.attrib.get("height", self.height))
         self.tilewidth = int(root.attrib.get("tilewidth", self.tilewidth))
@@ -207,40 +1008,76 @@ class TileMap:
         if self.nextobjectid is not None:
             self.nextobjectid = int(self.nextobjectid)
 
-        for child in root:
-            if child.tag == "editorsettings":
-                self.editorsettings = EditorSettings.read_elem(child, fd)
-            elif child.tag == "properties":
-                self.properties.extend(local.read_list_elem(
-                    child, "property", Property, fd))
-            elif child.tag == "tileset":
-                self.tilesets.append(Tileset.read_elem(child, fd))
-            elif child.tag == "layer":
-                self.layers.append(Layer.read_elem(child, fd))
-            elif child.tag == "objectgroup":
-                self.layers.append(ObjectGroup.read_elem(child, fd))
-            elif child.tag == "imagelayer":
-                self.layers.append(ImageLayer.read_elem(child, fd))
-            elif child.tag == "group":
-                self.layers.append(GroupLayer.read_elem(child, fd))
-
-        return self
-
-    def save(self, fname, data_encoding="base64", data_compression=True):
+    def save(self, fname, data_encoding="base64", data_compression=True,
+             data_compressionlevel=None, workers=None,
+             written_tilesets=None, base_dir=None, file_compression=None,
+             file_compressionlevel=None, write_tilesets=True):
         """
-        Save the object to the file with the indicated name.
+        Save the object to a TMX file.  ``fname`` can be the name of
+        the file or a binary file object to write it to.
 
         Arguments:
 
         - ``data_encoding`` -- The encoding to use for layers.  Can be
-          ``"base64"`` or ``"csv"``.  Set to :const:`None` for the
-          default encoding (currently ``"base64"``).
-        - ``data_compression`` -- Whether or not compression should be
-          used on layers if possible (currently only possible for
-          base64-encoded data).
+          ``"base64"`` or ``"csv"``.  Set to :const:`None` to write
+          each tile as a ``<tile>`` element instead (deprecated by
+          Tiled, and far larger).
+        - ``data_compression`` -- The compression method to use on
+          layers if possible (currently only possible for
+          base64-encoded data).  Can be ``"zlib"``, ``"gzip"``, or
+          ``"zstd"``; :const:`True` means ``"zlib"``, and
+          :const:`False` or :const:`None` means no compression.
+          ``"zstd"`` requires the :mod:`compression.zstd` module or the
+          zstandard package.
+        - ``data_compressionlevel`` -- The compression level to use on
+          layers, or :const:`None` to use :attr:`compressionlevel`.
+        - ``workers`` -- The number of threads to encode and compress
+          the tile data of layers and chunks with.  Set to :const:`None`
+          or less than 2 to encode everything in the calling thread.
+        - ``written_tilesets`` -- A dictionary recording the external
+          tilesets already written (see :meth:`Tileset.save`), or
+          :const:`None`.  External tilesets are written at most once
+          per save; pass the same dictionary to each call when saving a
+          batch of maps to write each of them at most once per batch.
+        - ``base_dir`` -- The directory to make paths of external
+          files, such as tilesets and images, relative to, or
+          :const:`None` to use the directory containing the file if
+          ``fname`` is a file name, or the current directory otherwise.
+        - ``file_compression`` -- The compression method to use on the
+          file itself: ``"gzip"``, ``"zstd"``, or :const:`False` for no
+          compression.  Set to :const:`None` to choose by the suffix of
+          ``fname`` as in :meth:`load`.  The output is compressed as
+          it is written.
+        - ``file_compressionlevel`` -- The compression level to use on
+          the file, or :const:`None` for the compression method's
+          default level.
+        - ``write_tilesets`` -- Whether or not to write external
+          tilesets.  Set to :const:`False` to only write the map, e.g.
+          when saving to a file object, and leave the TSX files alone.
+
+        External tilesets are written to the files named by their
+        :attr:`Tileset.source` attributes, except for those which are
+        unchanged since they were read from or last saved to those
+        files (see :meth:`Tileset.save`), so saving a map never
+        rewrites tilesets it didn't change.  This includes tilesets
+        read through a ``resolver`` (see :meth:`load`), which are
+        never written unless they were changed.
+
+        Layers and chunks remember the data their tiles were last
+        encoded to, or lazily loaded from (see :meth:`load`), along
+        with its encoding, compression method, and compression level
+        (:attr:`compressionlevel` for loaded data) and a digest of the
+        tiles.  Tiles which have not
+        changed since then are written from that data instead of being
+        encoded and compressed again if they are saved with the same
+        settings.
         """
-        if data_encoding is None:
-            data_encoding = "base64"
+        if data_encoding != "base64" or not data_compression:
+            data_compression = None
+        elif data_compression is True:
+            data_compression = "zlib"
+        if data_compressionlevel is None:
+            data_compressionlevel = self.compressionlevel
 
         bgc = str(self.backgroundcolor) if self.backgroundcolor else None
         attr = {"version": self.version, "tiledversion": self.tiledversion,
@@ -254,21 +1091,87 @@ class TileMap:
                 "nextlayerid": self.nextlayerid,
                 "nextobjectid": self.nextobjectid}
         root = ET.Element("map", attrib=local.clean_dict(attr))
-        fd = os.path.dirname(fname)
+        fd = local.xml_source(fname, base_dir)[1] or os.curdir
+        if file_compression is None:
+            file_compression = local.guess_file_compression(fname)
+        if written_tilesets is None:
+            written_tilesets = {}
 
         if self.editorsettings is not None:
-            root.append(self.editorsettings.get_elem(fd, data_encoding,
-                                                     data_compression))
+            root.append(self.editorsettings.get_elem(
+                fd, data_encoding, data_compression, data_compressionlevel))
 
         if self.properties:
-            root.append(local.get_list_elem(self.properties, "properties", fd,
-                                            data_encoding, data_compression))
+            root.append(local.get_list_elem(
+                self.properties, "properties", fd, data_encoding,
+                data_compression, data_compressionlevel))
 
         for tileset in self.tilesets:
-            root.append(tileset.get_elem(fd, data_encoding, data_compression))
+            if tileset.source and write_tilesets:
+                tileset.save(written=written_tilesets)
+            root.append(tileset.get_elem(fd, data_encoding, data_compression,
+                                         data_compressionlevel))
+
+        # Layers are written as their elements are created, so the
+        # document is never held in memory in full.
+        with local.open_file(fname, "wb", file_compression,
+                             file_compressionlevel) as f:
+            f.write(local.XML_DECLARATION)
+            if not self.layers and not len(root):
+                local.write_elem(f, root)
+                return
+
+            local.write_open_elem(f, root)
+            local.write_elems(f, self.layers, fd, data_encoding,
+                              data_compression, data_compressionlevel,
+                              workers)
+            local.write_close_elem(f, root)
+
+
+class _ObjectIdIndex:
+
+    # An index of the objects of a map's object groups by ID, kept up
+    # to date by the map's layer lists, its object groups and their
+    # objects as they are changed.  ``objects`` maps IDs to tuples (obj,
+    # group), where obj is None for objects stored in a PackedObjects
+    # object, which finds them by ID itself.  ``max_id`` is the highest
+    # ID indexed so far.
+
+    def __init__(self, layers):
+        self.objects = {}
+        self.max_id = 0
+        self.add_layers(layers)
+
+    def add_layers(self, layers):
+        for layer in layers:
+            if isinstance(layer, ObjectGroup):
+                self.update(layer, layer._object_ids(), [])
+            elif isinstance(layer, GroupLayer):
+                self.add_layers(layer.layers)
+
+    def remove_layers(self, layers):
+        for layer in layers:
+            if isinstance(layer, ObjectGroup):
+                self.update(layer, [], layer._object_ids())
+            elif isinstance(layer, GroupLayer):
+                self.remove_layers(layer.layers)
 
-        for layer in self.layers:
-            root.append(layer.get_elem(fd, data_encoding, data_compression))
+    def update(self, group, added, removed):
+        objects = self.objects
+        for id_, obj in removed:
+            entry = objects.get(id_)
+            if entry is not None and entry[0] is obj and entry[1] is group:
+                del objects[id_]
+        for id_, obj in added:
+            if id_ is not None:
+                objects[id_] = (obj, group)
+                if id_ > self.max_id:
+                    self.max_id = id_
 
-        tree = ET.ElementTree(root)
-        tree.write(fname, encoding="UTF-8", xml_declaration=True)
+    def find(self, id_):
+        entry = self.objects.get(id_)
+        if entry is None or entry[0] is not None:
+            return entry
+        group = entry[1]
+        row = group.objects._id_row(id_)
+        return None if row is None else (group.objects[row], group)
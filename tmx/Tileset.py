@@ -13,8 +13,13 @@
 # limitations under the License.
 
 
+import collections
+import copy
+import hashlib
+import io
 import os
 import pathlib
+import threading
 import xml.etree.ElementTree as ET
 
 from . import local
@@ -22,7 +27,7 @@ from .Image import Image
 from .Property import Property
 from .TerrainType import TerrainType
 from .Tile import Tile
-from .Wangset import Wangset
+from .WangSet import WangSet
 
 
 class Tileset:
@@ -136,10 +141,29 @@ class Tileset:
 
     .. attribute:: wangsets
 
-       A list of :class:`tmx.Wangset` objects indicating the Wang sets
+       A list of :class:`tmx.WangSet` objects indicating the Wang sets
        defined for the tileset.
+
+    External tilesets are cached process-wide: when several maps refer
+    to the same TSX file (and the file hasn't changed since it was last
+    read), it is only read once, and the resulting tilesets share
+    everything except :attr:`firstgid` and :attr:`source`.  Such
+    tilesets should be treated as read-only; to modify one, replace
+    the attributes you change (e.g. assign a new list to
+    :attr:`tiles`) rather than modifying them in place.
+
+    .. attribute:: cache_size
+
+       Class attribute indicating the maximum number of external
+       tilesets to keep cached.  When the cache is full, the least
+       recently used tileset is discarded.  Set to ``0`` to disable
+       caching.  Default is ``64``.
     """
 
+    cache_size = 64
+    _cache = collections.OrderedDict()
+    _cache_lock = threading.Lock()
+
     def __init__(self, firstgid, name, tilewidth, tileheight, source=None,
                  spacing=0, margin=0, xoffset=0, yoffset=0, tilecount=None,
                  columns=None, properties=None, image=None, terraintypes=None,
@@ -165,10 +189,17 @@ class Tileset:
         self.gridheight = gridheight
         self.wangsets = wangsets or []
 
+        # The real path of the TSX file the tileset was last read from
+        # or saved to and a digest of its contents then; see save().
+        self._saved = None
+
     @classmethod
-    def read_elem(cls, elem, fd):
+    def read_elem(cls, elem, fd, resolver=None):
         """
         Read XML element ``elem`` and return an object of this class.
+        If ``resolver`` is not :const:`None`, external tilesets are
+        read from what it returns when called with their file names
+        (see :meth:`TileMap.load`) rather than from the files.
 
         This is a low-level method used internally by this library; you
         don't typically need to use it.
@@ -177,11 +208,69 @@ class Tileset:
         source = elem.attrib.get("source")
         if source is not None:
             source = os.path.join(fd, source)
+            if resolver is not None:
+                # Resolved tilesets can't be checked for changes, so
+                # they aren't cached.
+                f, tfd = local.xml_source(resolver(source),
+                                          os.path.dirname(source))
+                tileset = cls._read_root(ET.parse(f).getroot(), tfd,
+                                         firstgid, source)
+                tileset._mark_saved(source)
+                return tileset
+            return cls._read_source(source, firstgid)
+
+        return cls._read_root(elem, fd, firstgid, source)
+
+    @classmethod
+    def _read_source(cls, source, firstgid):
+        # Read the external tileset ``source``, using the cache if
+        # possible.
+        path = os.path.realpath(source)
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        tileset = None
+
+        with cls._cache_lock:
+            entry = cls._cache.get(path)
+            if entry is not None and entry[0] == stamp:
+                cls._cache.move_to_end(path)
+                tileset = entry[1]
+
+        if tileset is None:
             root = ET.parse(source).getroot()
-            fd = os.path.dirname(source)
-        else:
-            root = elem
+            tileset = cls._read_root(root, os.path.dirname(source), firstgid,
+                                     source)
+            tileset._mark_saved(source)
+            with cls._cache_lock:
+                if cls.cache_size > 0:
+                    cls._cache[path] = (stamp, tileset)
+                    cls._cache.move_to_end(path)
+                while len(cls._cache) > max(cls.cache_size, 0):
+                    cls._cache.popitem(last=False)
+
+        tileset = copy.copy(tileset)
+        tileset.firstgid = firstgid
+        tileset.source = source
+        return tileset
+
+    @classmethod
+    def invalidate_cache(cls, source=None):
+        """
+        Remove the external tileset read from the file ``source`` from
+        the cache, or clear the cache entirely if ``source`` is
+        :const:`None`.  Cached tilesets are automatically re-read when
+        their files are modified, so this is only needed to free memory
+        or in case a file's modification time and size are unchanged.
+        """
+        with cls._cache_lock:
+            if source is None:
+                cls._cache.clear()
+            else:
+                cls._cache.pop(os.path.realpath(source), None)
 
+    @classmethod
+    def _read_root(cls, root, fd, firstgid, source):
+        # Read the tileset stored in XML element ``root``.
         name = root.attrib.get("name", "")
         tilewidth = int(root.attrib.get("tilewidth", 32))
         tileheight = int(root.attrib.get("tileheight", 32))
@@ -226,7 +315,7 @@ class Tileset:
                 tiles.append(Tile.read_elem(child, fd))
             elif child.tag == "wangsets":
                 wangsets.extend(local.read_list_elem(child, "wangset",
-                                                     Wangset, fd))
+                                                     WangSet, fd))
 
         return cls(firstgid, name, tilewidth, tileheight, source, spacing,
                    margin, xoffset, yoffset, tilecount, columns, properties,
@@ -235,73 +324,137 @@ class Tileset:
 
     def get_elem(self, fd, encoding, compression, compressionlevel):
         """
-        Return an XML element for the object.
+        Return an XML element for the object.  If :attr:`source` is
+        set, this is only a reference to the external tileset; use
+        :meth:`save` to write the external tileset itself.
 
         This is a low-level method used internally by this library; you
         don't typically need to use it.
         """
-        def append_elems(root):
-            nonlocal self, fd
-
-            if self.xoffset or self.yoffset:
-                attr = {"x": self.xoffset, "y": self.yoffset}
-                root.append(ET.Element(
-                    "tileoffset", attrib=local.clean_dict(attr)))
-
-            if (self.gridorientation is not None or
-                    self.gridwidth is not None or self.gridheight is not None):
-                attr = {"orientation": self.gridorientation,
-                        "width": self.gridwidth, "height": self.gridheight}
-                root.append(ET.Element("grid", attrib=local.clean_dict(attr)))
-
-            if self.properties:
-                root.append(local.get_list_elem(
-                    self.properties, "properties", fd, encoding, compression,
-                    compressionlevel))
-
-            if self.image is not None:
-                root.append(self.image.get_elem(
-                    fd, encoding, compression, compressionlevel))
-
-            if self.terraintypes:
-                root.append(local.get_list_elem(
-                    self.terraintypes, "terraintypes", fd, encoding,
-                    compression, compressionlevel))
-
-            if self.wangsets:
-                root.append(local.get_list_elem(
-                    self.wangsets, "wangsets", fd, encoding, compression,
-                    compressionlevel))
-
-            for tile in self.tiles:
-                root.append(tile.get_elem(fd, encoding, compression,
-                                          compressionlevel))
-
         if self.source:
             pth = os.path.relpath(self.source, fd)
-            source = pathlib.PurePath(pth).as_posix()
-            fd = os.path.dirname(pth)
-
-            # Write main element
-            attr = {"firstgid": self.firstgid, "source": source}
-            elem = ET.Element("tileset", attrib=local.clean_dict(attr))
-
-            # Write external tileset
-            attr = {"name": self.name, "tilewidth": self.tilewidth,
-                    "tileheight": self.tileheight,
-                    "spacing": self.spacing or None,
-                    "margin": self.margin or None, "tilecount": self.tilecount,
-                    "columns": self.columns or None}
-            child = ET.Element("tileset", attrib=local.clean_dict(attr))
-            elem.append(child)
-            append_elems(child) 
-        else:
-            attr = {"firstgid": self.firstgid, "name": self.name,
-                    "tilewidth": self.tilewidth, "tileheight": self.tileheight,
-                    "spacing": self.spacing or None,
-                    "margin": self.margin or None, "tilecount": self.tilecount,
-                    "columns": self.columns or None}
-            elem = ET.Element("tileset", attrib=local.clean_dict(attr))
-            append_elems(elem)
+            attr = {"firstgid": self.firstgid,
+                    "source": pathlib.PurePath(pth).as_posix()}
+            return ET.Element("tileset", attrib=local.clean_dict(attr))
+
+        attr = {"firstgid": self.firstgid, "name": self.name,
+                "tilewidth": self.tilewidth, "tileheight": self.tileheight,
+                "spacing": self.spacing or None,
+                "margin": self.margin or None, "tilecount": self.tilecount,
+                "columns": self.columns or None}
+        elem = ET.Element("tileset", attrib=local.clean_dict(attr))
+        self._append_elems(elem, fd, encoding, compression, compressionlevel)
 
         return elem
+
+    def save(self, fname=None, written=None):
+        """
+        Save the tileset to the external TSX file with the indicated
+        name, or to :attr:`source` if ``fname`` is :const:`None`.
+        Return whether or not the file was written.
+
+        The file is not written if the tileset is unchanged since it
+        was read from or last saved to that file, even if the file
+        doesn't exist (as for tilesets read through a resolver; see
+        :meth:`TileMap.load`), or if the file already has exactly the
+        content that would be written to it.
+        Tilesets loaded from TSX files and never modified are thus
+        never rewritten, so files written by other programs such as
+        Tiled keep their exact contents, and unchanged tilesets don't
+        cause any disk writes (and stay valid in the tileset cache).
+
+        Arguments:
+
+        - ``written`` -- A dictionary shared between calls recording
+          the TSX files already written, or :const:`None`.  If the file
+          is already recorded in it, nothing is done at all, not even
+          generating the tileset's XML; otherwise, the file is recorded
+          in it.  :meth:`TileMap.save` uses this to write each external
+          tileset once per save, or once per batch of maps.
+        """
+        if fname is None:
+            fname = self.source
+        path = os.path.realpath(fname)
+        if written is not None and path in written:
+            return False
+
+        data = self._tsx_data(fname)
+        digest = hashlib.sha256(data).hexdigest()
+        if written is not None:
+            written[path] = digest
+
+        if self._saved == (path, digest):
+            return False
+
+        try:
+            if os.path.getsize(path) == len(data):
+                with open(path, "rb") as old:
+                    if hashlib.sha256(old.read()).hexdigest() == digest:
+                        self._saved = (path, digest)
+                        return False
+        except OSError:
+            pass
+
+        with open(fname, "wb") as f:
+            f.write(data)
+        self._saved = (path, digest)
+
+        return True
+
+    def _mark_saved(self, fname):
+        # Record that the tileset is unchanged from the TSX file ``fname``.
+        data = self._tsx_data(fname)
+        self._saved = (os.path.realpath(fname),
+                       hashlib.sha256(data).hexdigest())
+
+    def _tsx_data(self, fname):
+        # Return the contents of the TSX file ``fname`` for the tileset.
+        fd = os.path.dirname(fname) or os.curdir
+        attr = {"name": self.name, "tilewidth": self.tilewidth,
+                "tileheight": self.tileheight,
+                "spacing": self.spacing or None,
+                "margin": self.margin or None, "tilecount": self.tilecount,
+                "columns": self.columns or None}
+        elem = ET.Element("tileset", attrib=local.clean_dict(attr))
+        self._append_elems(elem, fd, "base64", None, None)
+
+        f = io.BytesIO()
+        ET.ElementTree(elem).write(f, encoding="UTF-8", xml_declaration=True)
+        return f.getvalue()
+
+    def _append_elems(self, root, fd, encoding, compression,
+                      compressionlevel):
+        # Append the XML elements of the tileset's contents to ``root``.
+        if self.xoffset or self.yoffset:
+            attr = {"x": self.xoffset, "y": self.yoffset}
+            root.append(ET.Element(
+                "tileoffset", attrib=local.clean_dict(attr)))
+
+        if (self.gridorientation is not None or
+                self.gridwidth is not None or self.gridheight is not None):
+            attr = {"orientation": self.gridorientation,
+                    "width": self.gridwidth, "height": self.gridheight}
+            root.append(ET.Element("grid", attrib=local.clean_dict(attr)))
+
+        if self.properties:
+            root.append(local.get_list_elem(
+                self.properties, "properties", fd, encoding, compression,
+                compressionlevel))
+
+        if self.image is not None:
+            root.append(self.image.get_elem(
+                fd, encoding, compression, compressionlevel))
+
+        if self.terraintypes:
+            root.append(local.get_list_elem(
+                self.terraintypes, "terraintypes", fd, encoding,
+                compression, compressionlevel))
+
+        if self.wangsets:
+            root.append(local.get_list_elem(
+                self.wangsets, "wangsets", fd, encoding, compression,
+                compressionlevel))
+
+        for tile in self.tiles:
+            root.append(tile.get_elem(fd, encoding, compression,
+                                      compressionlevel))
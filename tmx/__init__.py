@@ -48,6 +48,10 @@ __all__ = [
     "Layer",
     "LayerTile",
     "LayerChunk",
+    "MapInfo",
+    "PackedTiles",
+    "PackedObjects",
+    "PackedPoints",
     "ObjectGroup",
     "Object",
     "ImageLayer",
@@ -74,8 +78,12 @@ from .ImageLayer import ImageLayer
 from .Layer import Layer
 from .LayerChunk import LayerChunk
 from .LayerTile import LayerTile
+from .MapInfo import MapInfo
 from .Object import Object
 from .ObjectGroup import ObjectGroup
+from .PackedObjects import PackedObjects
+from .PackedPoints import PackedPoints
+from .PackedTiles import PackedTiles
 from .Property import Property
 from .TerrainType import TerrainType
 from .Text import Text
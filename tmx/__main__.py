@@ -20,8 +20,14 @@ embarrassing bugs.
 """
 
 
+import copy
 import datetime
+import io
 import os
+import pathlib
+import pickle
+import random
+import tempfile
 import xml.etree.ElementTree as ET
 
 import tmx
@@ -119,9 +125,10 @@ frame = tmx.Frame(0, 666)
 terraintype.properties.append(int_prop)
 
 tile.type = "waffles"
-tile.terrain = "0,0,0,0,0,0,0,0"
-tile.probability = "0.5"
-tile.properties.append("color_prop")
+tile.terrain_topleft = tile.terrain_topright = 0
+tile.terrain_bottomleft = tile.terrain_bottomright = 0
+tile.probability = 0.5
+tile.properties.append(color_prop)
 tile.image = image
 tile.animation = [frame, frame]
 
@@ -140,3 +147,397 @@ tileset.image = image
 test(desc, tilemap, "csv", False)
 
 print(f"{test_n} tests completed. Please review the generated files.")
+
+
+# Round-trip checks: unlike the tests above, these check their own
+# results, working in a temporary directory.
+check_n = 0
+
+
+def check(desc, result):
+    global check_n
+    print(f"Check {check_n}: {desc}")
+    if not result:
+        raise AssertionError(f"Check {check_n} failed: {desc}")
+    check_n += 1
+
+
+def read_bytes(fname):
+    with open(fname, "rb") as f:
+        return f.read()
+
+
+def gids(tiles):
+    return [int(tile) for tile in tiles]
+
+
+rng = random.Random(1234)
+formats = [("csv", False), ("base64", False), ("base64", "zlib"),
+           ("base64", "gzip"), (None, False)]
+start_dir = os.getcwd()
+tmpdir = tempfile.TemporaryDirectory()
+os.chdir(tmpdir.name)
+
+
+desc = "packed tiles ({}, {}) packed={}"
+
+tilemap = tmx.TileMap()
+tilemap.width = 20
+tilemap.height = 15
+tile_gids = [rng.randrange(50) for i in range(20 * 15)]
+tile_gids[7] |= 2 ** 31
+tile_layer = tmx.Layer("tiles", width=20, height=15, tiles=[
+    tmx.LayerTile(gid & 0x0FFFFFFF, bool(gid >> 31)) for gid in tile_gids])
+objectgroup = tmx.ObjectGroup("objects", objects=[
+    tmx.Object("a", "b", 1, 2, 3, 4, id_=1),
+    tmx.Object("c", "", 5, -6, polygon=[(0, 0), (-1, 2.5), (3, 4)], id_=2)])
+grouplayer = tmx.GroupLayer("group", layers=[tmx.Layer(
+    "inner", width=20, height=15,
+    tiles=[tmx.LayerTile(1) for gid in tile_gids])])
+tilemap.properties = [str_prop, int_prop, float_prop, color_prop]
+tilemap.layers = [tile_layer, objectgroup, grouplayer]
+
+saved = []
+for encoding, compression in formats:
+    fname = f"tiles_{len(saved)}.tmx"
+    tilemap.save(fname, encoding, compression)
+    saved.append(fname)
+    # Loading normalizes some values (e.g. rotation is read as a float),
+    # so compare against a plain load and save.
+    tmx.TileMap.load(fname).save(fname, encoding, compression)
+    original = read_bytes(fname)
+    for packed in (False, True):
+        loaded = tmx.TileMap.load(fname, packed=packed)
+        loaded.save("copy.tmx", encoding, compression)
+        check(desc.format(encoding, compression, packed),
+              gids(loaded.layers[0].tiles) == tile_gids and
+              read_bytes("copy.tmx") == original)
+
+
+desc = "lazy tiles ({}, {}) packed={}"
+
+for fname, (encoding, compression) in zip(saved, formats):
+    original = read_bytes(fname)
+    for packed in (False, True):
+        # Saved before the tiles are accessed, then after.
+        loaded = tmx.TileMap.load(fname, packed=packed, lazy=True)
+        loaded.save("copy.tmx", encoding, compression)
+        ok = read_bytes("copy.tmx") == original
+        ok = ok and gids(loaded.layers[0].tiles) == tile_gids
+        loaded.save("copy.tmx", encoding, compression)
+        ok = ok and read_bytes("copy.tmx") == original
+        check(desc.format(encoding, compression, packed), ok)
+
+
+desc = "streaming save matches ElementTree ({})"
+
+for fname in saved:
+    f = io.BytesIO()
+    ET.ElementTree(ET.parse(fname).getroot()).write(
+        f, encoding="UTF-8", xml_declaration=True)
+    check(desc.format(fname), f.getvalue() == read_bytes(fname))
+
+
+desc = "chunk get_tile and set_tile ({})"
+
+chunk_layer = tmx.Layer("chunks")
+chunk_gids = {}
+for i in range(400):
+    x = rng.randrange(-40, 40)
+    y = rng.randrange(-40, 40)
+    chunk_gids[x, y] = rng.randrange(1, 100)
+    chunk_layer.set_tile(x, y, chunk_gids[x, y], chunksize=(8, 8))
+tilemap = tmx.TileMap()
+tilemap.layers = [chunk_layer]
+
+
+def tiles_match(layer, tiles):
+    return all(int(layer.get_tile(x, y)) == tiles.get((x, y), 0)
+               for x in range(-45, 45) for y in range(-45, 45))
+
+
+check(desc.format("in memory"), tiles_match(chunk_layer, chunk_gids) and
+      all(chunk.width == chunk.height == 8 and
+          chunk.x % 8 == chunk.y % 8 == 0 for chunk in chunk_layer.chunks))
+
+for encoding, compression in formats:
+    fname = f"chunks_{len(saved)}.tmx"
+    tilemap.save(fname, encoding, compression)
+    loaded = tmx.TileMap.load(fname)
+    check(desc.format(f"{encoding}, {compression}"),
+          tiles_match(loaded.layers[0], chunk_gids))
+
+
+desc = "region matches get_tile ({})"
+
+
+def region_matches(layer, tiles, count=30):
+    for i in range(count):
+        x = rng.randrange(-50, 40)
+        y = rng.randrange(-50, 40)
+        width = rng.randrange(1, 30)
+        height = rng.randrange(1, 30)
+        expected = [tiles.get((x + i, y + j), 0)
+                    for j in range(height) for i in range(width)]
+        if gids(layer.region(x, y, width, height)) != expected:
+            return False
+    return True
+
+
+finite_gids = {(i % 20, i // 20): gid for i, gid in enumerate(tile_gids)}
+check(desc.format("finite layer"), region_matches(tile_layer, finite_gids))
+check(desc.format("chunks"), region_matches(chunk_layer, chunk_gids))
+
+
+desc = "chunks paged under a chunk budget ({}, {})"
+
+for encoding, compression in formats:
+    fname = f"paged_{encoding}_{compression}.tmx"
+    tilemap.save(fname, encoding, compression)
+    loaded = tmx.TileMap.load(fname, packed=True, chunk_budget=3)
+    loaded_layer = loaded.layers[0]
+    ok = tiles_match(loaded_layer, chunk_gids)
+    changed = dict(chunk_gids)
+    for i in range(100):
+        x = rng.randrange(-40, 40)
+        y = rng.randrange(-40, 40)
+        changed[x, y] = rng.randrange(1, 100)
+        loaded_layer.set_tile(x, y, changed[x, y])
+    ok = ok and region_matches(loaded_layer, changed)
+    ok = ok and tiles_match(loaded_layer, changed)
+    loaded.save(fname, encoding, compression)
+    ok = ok and tiles_match(tmx.TileMap.load(fname).layers[0], changed)
+    check(desc.format(encoding, compression), ok)
+
+
+desc = "map_tiles ({})"
+
+tmx.TileMap.load(saved[0]).export_tiles("tiles.bin")
+mapped = tmx.TileMap.load(saved[0], lazy=True)
+mapped.map_tiles("tiles.bin")
+check(desc.format("same map"), gids(mapped.layers[0].tiles) == tile_gids)
+
+mismatched = tmx.TileMap.load(saved[0], lazy=True)
+mismatched.layers[0].width = 19
+try:
+    mismatched.map_tiles("tiles.bin")
+except ValueError:
+    check(desc.format("wrong size"), True)
+else:
+    check(desc.format("wrong size"), False)
+
+
+desc = "spatial query matches brute force ({})"
+
+
+def overlaps(bounds, x, y, width, height):
+    bx, by, bwidth, bheight = bounds
+    return (bx <= x + width and x <= bx + bwidth and
+            by <= y + height and y <= by + bheight)
+
+
+def query_matches(objectgroup):
+    for step in range(3):
+        for i in range(50):
+            x = rng.uniform(-600, 600)
+            y = rng.uniform(-600, 600)
+            width = rng.choice([0, rng.uniform(0, 300)])
+            height = rng.choice([0, rng.uniform(0, 300)])
+            found = [obj.bounds for obj in
+                     objectgroup.query(x, y, width, height)]
+            brute = [obj.bounds for obj in objectgroup.objects
+                     if overlaps(obj.bounds, x, y, width, height)]
+            if found != brute:
+                return False
+        # Move, remove, and add objects before checking again.
+        for obj in rng.sample(list(objectgroup.objects), 20):
+            obj.x += rng.uniform(-300, 300)
+            obj.width = rng.uniform(0, 100)
+        del objectgroup.objects[5:15]
+        objectgroup.objects.insert(3, tmx.Object("", "", 0, 0, 50, 50))
+    return True
+
+
+def random_objects():
+    objects = []
+    for i in range(300):
+        obj = tmx.Object("", "", rng.uniform(-500, 500),
+                         rng.uniform(-500, 500), rng.uniform(0, 100),
+                         rng.uniform(0, 100))
+        if i % 10 == 0:
+            obj.rotation = rng.uniform(0, 360)
+        elif i % 10 == 1:
+            obj.gid = 1
+        elif i % 10 == 2:
+            obj.polygon = [(rng.uniform(-200, 200), rng.uniform(-200, 200))
+                           for j in range(5)]
+        objects.append(obj)
+    objects.append(tmx.Object("", "", -5000, -5000, 10000, 10000))
+    return objects
+
+
+check(desc.format("list"),
+      query_matches(tmx.ObjectGroup("spatial", objects=random_objects())))
+
+
+desc = "packed objects ({})"
+
+packed_objects = tmx.PackedObjects(random_objects())
+check(desc.format("query"),
+      query_matches(tmx.ObjectGroup("spatial", objects=packed_objects)))
+
+
+desc = "find_object and new_object_id ({})"
+
+tilemap = tmx.TileMap()
+tilemap.nextobjectid = 3
+objectgroup = tmx.ObjectGroup("ids", objects=[
+    tmx.Object("", "", 0, 0, id_=1), tmx.Object("", "", 0, 0, id_=2)])
+packedgroup = tmx.ObjectGroup("packed ids", objects=tmx.PackedObjects([
+    tmx.Object("", "", 0, 0, id_=10), tmx.Object("", "", 0, 0, id_=11)]))
+grouplayer = tmx.GroupLayer("group", layers=[packedgroup])
+tilemap.layers = [objectgroup, grouplayer]
+
+obj, group = tilemap.find_object(2)
+check(desc.format("list"), obj.id == 2 and group is objectgroup)
+obj, group = tilemap.find_object(11)
+check(desc.format("packed"), obj.id == 11 and group is packedgroup)
+check(desc.format("missing"), tilemap.find_object(5) is None)
+check(desc.format("new ID"), tilemap.new_object_id() == 12 and
+      tilemap.nextobjectid == 13)
+
+new = tmx.Object("", "", 0, 0, id_=tilemap.new_object_id())
+objectgroup.objects.append(new)
+check(desc.format("appended"),
+      tilemap.find_object(new.id) == (new, objectgroup))
+new.id = 40
+check(desc.format("renumbered"), tilemap.find_object(13) is None and
+      tilemap.find_object(40) == (new, objectgroup))
+del objectgroup.objects[0]
+check(desc.format("removed"), tilemap.find_object(1) is None)
+del packedgroup.objects[0]
+check(desc.format("packed removed"), tilemap.find_object(10) is None and
+      tilemap.find_object(11)[0].id == 11)
+grouplayer.layers.remove(packedgroup)
+check(desc.format("layer removed"), tilemap.find_object(11) is None)
+tilemap.layers.append(packedgroup)
+check(desc.format("layer added"), tilemap.find_object(11)[1] is packedgroup)
+check(desc.format("next ID"), tilemap.new_object_id() == 41)
+
+
+desc = "encoded data kept for reuse ({})"
+
+loaded = tmx.TileMap.load(saved[1], packed=True)
+check(desc.format("not after eager loads"),
+      not loaded.layers[0]._encoded_cache)
+loaded = tmx.TileMap.load(saved[1], packed=True, workers=2)
+check(desc.format("not after parallel loads"),
+      not loaded.layers[0]._encoded_cache)
+loaded = tmx.TileMap.load(saved[1], packed=True, lazy=True)
+loaded.layers[0].tiles
+loaded.save("copy.tmx", *formats[1])
+check(desc.format("after lazy loads"), loaded.layers[0]._encoded_cache and
+      read_bytes("copy.tmx") == read_bytes(saved[1]))
+
+
+desc = "lazy tiles saved with another compression level"
+
+tmx.TileMap.load(saved[2]).save("level1.tmx", "base64", "zlib", 1)
+tmx.TileMap.load("level1.tmx").save("level9.tmx", "base64", "zlib", 9)
+tmx.TileMap.load("level1.tmx", lazy=True).save("copy.tmx", "base64", "zlib",
+                                                9)
+check(desc, read_bytes("copy.tmx") == read_bytes("level9.tmx"))
+
+
+desc = "in-memory load and save with a resolver ({})"
+
+tsx_name = os.path.join("pack", "tiles", "terrain.tsx")
+files = {tsx_name: b'<tileset name="terrain" tilewidth="32" '
+                   b'tileheight="32" tilecount="0" columns="0" />'}
+map_data = (b'<map version="1.0" orientation="orthogonal" width="1" '
+            b'height="1" tilewidth="32" tileheight="32">'
+            b'<tileset firstgid="1" source="tiles/terrain.tsx" /></map>')
+loaded = tmx.TileMap.load(map_data, base_dir="pack",
+                          resolver=lambda name: files[name])
+loaded.save(io.BytesIO(), base_dir="pack")
+check(desc.format("unchanged tilesets aren't written"),
+      not os.path.exists("pack"))
+os.makedirs(os.path.join("pack", "tiles"))
+loaded.save(io.BytesIO(), base_dir="pack")
+check(desc.format("even if their directory exists"),
+      not os.path.exists(tsx_name))
+loaded.tilesets[0].tilewidth = 16
+loaded.save(io.BytesIO(), base_dir="pack", write_tilesets=False)
+check(desc.format("write_tilesets=False"), not os.path.exists(tsx_name))
+loaded.save(io.BytesIO(), base_dir="pack")
+check(desc.format("changed tilesets are written"),
+      tmx.TileMap.load(io.BytesIO(map_data),
+                       base_dir="pack").tilesets[0].tilewidth == 16)
+
+
+desc = "packed objects ({})"
+
+packed_objects = tmx.PackedObjects([
+    tmx.Object(None, None, 1, 2, properties=[int_prop], id_=7)])
+obj = packed_objects[0]
+copies = [copy.copy(obj), copy.deepcopy(obj), pickle.loads(pickle.dumps(obj))]
+check(desc.format("copies are detached"),
+      all(type(c) is tmx.Object and
+          (c.name, c.x, c.y, c.id) == (None, 1, 2, 7) and
+          [(p.name, p.value) for p in c.properties] == [("i", 42)]
+          for c in copies))
+copies[0].x = 5
+check(desc.format("copies don't change the original"), obj.x == 1)
+
+
+desc = "region of a layer with missing tiles ({})"
+
+short_layer = tmx.Layer("short", 1, False, width=4, height=4)
+short_layer.tiles = tmx.PackedTiles(range(1, 7))
+block = short_layer.region(-1, 0, 6, 3)
+check(desc.format("fewer tiles than its size"),
+      len(block) == 18 and list(block.data) ==
+      [0, 1, 2, 3, 4, 0, 0, 5, 6, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+short_layer.width = None
+check(desc.format("no width"), list(short_layer.region(0, 0, 2, 2).data) ==
+      [0, 0, 0, 0])
+
+
+desc = "setting tiles of a layer with a size but no tiles ({})"
+
+for packed in (False, True):
+    sized_layer = tmx.Layer("sized", width=3, height=2)
+    if packed:
+        sized_layer.tiles = tmx.PackedTiles()
+    sized_layer.set_tile(2, 1, 7)
+    check(desc.format("packed" if packed else "list"),
+          not sized_layer.chunks and
+          isinstance(sized_layer.tiles, tmx.PackedTiles) == packed and
+          [int(tile) for tile in sized_layer.tiles] == [0, 0, 0, 0, 0, 7])
+
+
+desc = "snapshot with a separate tile file ({})"
+
+tmx.TileMap.load(saved[0]).save_snapshot("full.snapshot")
+tmx.TileMap.load(saved[0]).save_snapshot("tiles.snapshot", tiles="tiles.bin")
+reopened = tmx.TileMap.load_snapshot("tiles.snapshot", packed=True,
+                                     tiles="tiles.bin")
+check(desc.format("tiles are mapped"),
+      isinstance(reopened.layers[0].tiles.data, memoryview) and
+      gids(reopened.layers[0].tiles) == tile_gids)
+check(desc.format("tiles aren't in the snapshot"),
+      os.path.getsize("full.snapshot") - os.path.getsize("tiles.snapshot") >=
+      4 * len(tile_gids))
+check(desc.format("unpacked"),
+      gids(tmx.TileMap.load_snapshot("tiles.snapshot", tiles="tiles.bin")
+           .layers[0].tiles) == tile_gids)
+try:
+    tmx.TileMap.load_snapshot("tiles.snapshot")
+except ValueError:
+    check(desc.format("tile file required"), True)
+else:
+    check(desc.format("tile file required"), False)
+
+os.chdir(start_dir)
+tmpdir.cleanup()
+print(f"{check_n} checks passed.")
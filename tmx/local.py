@@ -18,17 +18,240 @@ Users can simply ignore this module.
 """
 
 
+import array
 import base64
+import collections
+import concurrent.futures
+import contextlib
 import gzip
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import threading
 import xml.etree.ElementTree as ET
+import xml.parsers.expat
+import xml.sax.saxutils
 import zlib
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from .LayerTile import LayerTile
+from .PackedPoints import PackedPoints
+from .PackedTiles import PackedTiles
+
+
+# Array type code of an unsigned 32-bit integer on this platform.
+GID_TYPECODE = "I" if array.array("I").itemsize == 4 else "L"
+
+# Flags stored in the four high bits of a raw global tile ID.
+GID_HFLIP = 2**31
+GID_VFLIP = 2**30
+GID_DFLIP = 2**29
+GID_HEXROTATE = 2**28
+GID_MASK = 2**28 - 1
+
+# The same flags as bits of the values returned by split_gids().
+FLAG_HFLIP = GID_HFLIP >> 28
+FLAG_VFLIP = GID_VFLIP >> 28
+FLAG_DFLIP = GID_DFLIP >> 28
+FLAG_HEXROTATE = GID_HEXROTATE >> 28
+
+# Byte translation tables splitting the most significant byte of a raw
+# global tile ID into its flag bits and its remaining ID bits.
+_HIGH_FLAGS = bytes([i >> 4 for i in range(256)])
+_HIGH_GID = bytes([i & 0x0F for i in range(256)])
+
+# File name suffixes of compressed TMX files.
+_FILE_COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
+# The XML declaration written by ElementTree for UTF-8 documents.
+XML_DECLARATION = b"<?xml version='1.0' encoding='UTF-8'?>\n"
+
+# Number of tiles write_tile_data() writes at a time.
+_TILE_DATA_BLOCK = 4096
+
+# Per-thread list of tile data waiting to be encoded by parallel_tiles().
+_pending = threading.local()
+
+
+def _check_zstd():
+    if zstd is None and zstandard is None:
+        e = ('Compression type "zstd" requires the compression.zstd module '
+             '(Python 3.14 or later) or the zstandard package.')
+        raise ImportError(e)
+
+
+def decompress(data, compression):
+    """
+    Decompress the bytes object ``data`` compressed with the
+    compression method ``compression`` and return the result.  Valid
+    compression methods are ``"gzip"``, ``"zlib"``, and ``"zstd"``.
+    Set ``compression`` to :const:`None` for no compression.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    if compression == "gzip":
+        return gzip.decompress(data)
+    elif compression == "zlib":
+        return zlib.decompress(data)
+    elif compression == "zstd":
+        _check_zstd()
+        if zstd is not None:
+            return zstd.decompress(data)
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    elif compression:
+        e = 'Compression type "{}" not supported.'.format(compression)
+        raise ValueError(e)
+
+    return data
+
+
+def compress(data, compression, compressionlevel=None):
+    """
+    Compress the bytes object ``data`` with the compression method
+    ``compression`` at level ``compressionlevel`` (or the method's
+    default level if :const:`None`) and return the result.  Valid
+    compression methods are ``"gzip"``, ``"zlib"``, and ``"zstd"``.
+    Set ``compression`` to :const:`None` for no compression.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    if compression == "gzip":
+        if compressionlevel is None:
+            compressionlevel = 9
+        # A fixed modification time keeps the output reproducible.
+        f = io.BytesIO()
+        with gzip.GzipFile(fileobj=f, mode="wb", mtime=0,
+                           compresslevel=compressionlevel) as gz:
+            gz.write(data)
+        return f.getvalue()
+    elif compression == "zlib":
+        if compressionlevel is None:
+            compressionlevel = -1
+        return zlib.compress(data, compressionlevel)
+    elif compression == "zstd":
+        _check_zstd()
+        if compressionlevel is None:
+            compressionlevel = 3
+        if zstd is not None:
+            return zstd.compress(data, level=compressionlevel)
+        return zstandard.ZstdCompressor(level=compressionlevel).compress(data)
+    elif compression:
+        e = 'Compression type "{}" not supported.'.format(compression)
+        raise ValueError(e)
+
+    return data
+
+
+def guess_file_compression(fname):
+    """
+    Return the compression method of the file ``fname`` as indicated
+    by its suffix: ``"gzip"`` for ``.gz`` and ``"zstd"`` for ``.zst``.
+    :const:`None` is returned for other suffixes and for anything
+    other than file names.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    if isinstance(fname, (str, os.PathLike)):
+        suffix = os.path.splitext(fname)[1].lower()
+        return _FILE_COMPRESSION_SUFFIXES.get(suffix)
+    return None
+
+
+def open_file(fname, mode, compression=None, compressionlevel=None):
+    """
+    Return a context manager giving a binary file object reading
+    (``mode`` is ``"rb"``) or writing (``mode`` is ``"wb"``) the file
+    ``fname``, which can be a file name or a binary file object, and
+    transparently decompressing or compressing it with the compression
+    method ``compression`` at level ``compressionlevel`` (or the
+    method's default level if :const:`None`).  Valid compression
+    methods are ``"gzip"`` and ``"zstd"``.  Set ``compression`` to
+    :const:`None` for no compression.
+
+    Compressed files are read and written incrementally.  File objects
+    passed as ``fname`` are never closed.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    named = isinstance(fname, (str, os.PathLike))
+    if mode != "wb":
+        compressionlevel = None
+
+    if compression == "gzip":
+        if compressionlevel is None:
+            compressionlevel = 9
+        # A fixed modification time keeps the output reproducible.
+        if named:
+            return gzip.GzipFile(fname, mode, compressionlevel, mtime=0)
+        return gzip.GzipFile(fileobj=fname, mode=mode,
+                             compresslevel=compressionlevel, mtime=0)
+    elif compression == "zstd":
+        _check_zstd()
+        if zstd is not None:
+            return zstd.ZstdFile(fname, mode, level=compressionlevel)
+        kwargs = {}
+        if mode == "wb":
+            if compressionlevel is None:
+                compressionlevel = 3
+            kwargs["cctx"] = zstandard.ZstdCompressor(level=compressionlevel)
+        return zstandard.open(fname, mode, closefd=False, **kwargs)
+    elif compression:
+        e = 'Compression type "{}" not supported.'.format(compression)
+        raise ValueError(e)
+
+    if named:
+        return open(fname, mode)
+    return contextlib.nullcontext(fname)
+
+
+def gid_array(data):
+    """
+    Return ``data``, a sequence of raw global tile IDs, as an
+    :class:`array.array` of unsigned 32-bit integers.  Arrays of that
+    type are returned as-is; a :class:`memoryview` of unsigned 32-bit
+    integers is copied in bulk.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    if isinstance(data, array.array) and data.itemsize == 4:
+        return data
+
+    tiles = array.array(GID_TYPECODE)
+    if isinstance(data, memoryview) and data.itemsize == 4:
+        tiles.frombytes(data.cast("B"))
+    else:
+        tiles.extend([int(i) for i in data])
+    return tiles
 
 
 def data_decode(data, encoding, compression=None):
     """
-    Decode encoded data and return a list of integers it represents.
+    Decode encoded data and return an :class:`array.array` of the
+    unsigned 32-bit integers it represents.
+
+    The whole decompressed buffer is converted in a single pass rather
+    than one integer at a time.
 
     This is a low-level function used internally by this library; you
     don't typically need to use it.
@@ -39,31 +262,28 @@ def data_decode(data, encoding, compression=None):
     - ``encoding`` -- The encoding of the data.  Can be ``"base64"`` or
       ``"csv"``.
     - ``compression`` -- The compression method used.  Valid compression
-      methods are ``"gzip"`` and ``"zlib"``.  Set to :const:`None` for
-      no compression.
+      methods are ``"gzip"``, ``"zlib"``, and ``"zstd"``.  Set to
+      :const:`None` for no compression.  ``"zstd"`` requires the
+      :mod:`compression.zstd` module or the zstandard package.
     """
     if encoding == "csv":
-        return [int(i) for i in data.strip().split(",")]
+        return array.array(GID_TYPECODE, map(int, data.strip().split(",")))
     elif encoding == "base64":
         data = base64.b64decode(data.strip().encode("latin1"))
+        data = decompress(data, compression)
 
-        if compression == "gzip":
-            data = gzip.decompress(data)
-        elif compression == "zlib":
-            data = zlib.decompress(data)
-        elif compression:
-            e = 'Compression type "{}" not supported.'.format(compression)
+        if len(data) % 4:
+            e = "Tile data length ({}) is not a multiple of 4.".format(
+                len(data))
             raise ValueError(e)
 
-        ndata = [i for i in data]
-
-        data = []
-        for i in range(0, len(ndata), 4):
-            n = (ndata[i]  + ndata[i + 1] * (2 ** 8) +
-                 ndata[i + 2] * (2 ** 16) + ndata[i + 3] * (2 ** 24))
-            data.append(n)
+        # Tile data is always little-endian.
+        tiles = array.array(GID_TYPECODE)
+        tiles.frombytes(data)
+        if sys.byteorder != "little":
+            tiles.byteswap()
 
-        return data
+        return tiles
     else:
         e = 'Encoding type "{}" not supported.'.format(encoding)
         raise ValueError(e)
@@ -71,35 +291,44 @@ def data_decode(data, encoding, compression=None):
 
 def data_encode(data, encoding, compression=True, compressionlevel=None):
     """
-    Encode a list of integers and return the encoded data.
+    Encode a sequence of integers and return the encoded data.
+
+    For base64 encoding, the whole sequence is packed into
+    little-endian unsigned 32-bit integers in a single operation
+    before it is compressed and encoded.
 
     This is a low-level function used internally by this library; you
     don't typically need to use it.
 
     Arguments:
 
-    - ``data`` -- The list of integers to encode.
+    - ``data`` -- The sequence of integers to encode.  This can be a
+      list, an :class:`array.array`, or a :class:`memoryview` of
+      unsigned 32-bit integers.
     - ``encoding`` -- The encoding of the data.  Can be ``"base64"`` or
       ``"csv"``.
-    - ``compression`` -- Whether or not compression should be used if
-      supported.
+    - ``compression`` -- The compression method to use if supported:
+      ``"gzip"``, ``"zlib"``, or ``"zstd"``.  :const:`True` means
+      ``"zlib"``, and :const:`None` or :const:`False` means no
+      compression.
     - ``compressionlevel`` -- The compression level to use, or
       :const:`None` to use the default.
     """
     if encoding == "csv":
-        return ','.join([str(i) for i in data])
+        return ','.join(map(str, data))
     elif encoding == "base64":
-        ndata = []
-        for i in data:
-            n = [i % (2 ** 8), i // (2 ** 8), i // (2 ** 16), i // (2 ** 24)]
-            ndata.extend(n)
+        tiles = gid_array(data)
 
-        data = b''.join([bytes((i,)) for i in ndata])
+        # Tile data is always little-endian.
+        if sys.byteorder != "little":
+            tiles = array.array(GID_TYPECODE, tiles)
+            tiles.byteswap()
 
-        if compression:
-            if compressionlevel is None:
-                compressionlevel = -1
-            data = zlib.compress(data, compressionlevel)
+        data = tiles.tobytes()
+
+        if compression is True:
+            compression = "zlib"
+        data = compress(data, compression, compressionlevel)
 
         return base64.b64encode(data).decode("latin1")
     else:
@@ -107,6 +336,65 @@ def data_encode(data, encoding, compression=True, compressionlevel=None):
         raise ValueError(e)
 
 
+def split_gids(data):
+    """
+    Split the raw 32-bit global tile IDs in ``data`` into their global
+    tile IDs and flags, and return a tuple ``(gids, flags)``.
+
+    ``gids`` is an :class:`array.array` of unsigned 32-bit integers
+    holding the global tile IDs with all flag bits cleared.  ``flags``
+    is an :class:`array.array` of unsigned bytes holding the four flag
+    bits of each tile, shifted down to the bottom of the byte:
+    ``FLAG_HFLIP`` (horizontal flip), ``FLAG_VFLIP`` (vertical flip),
+    ``FLAG_DFLIP`` (diagonal flip), and ``FLAG_HEXROTATE`` (120 degree
+    rotation on hexagonal maps).
+
+    The split is done with bulk byte operations (or NumPy, if it is
+    installed) rather than one tile at a time, so no per-tile objects
+    are created.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+
+    Arguments:
+
+    - ``data`` -- A sequence of raw global tile IDs, such as the
+      :attr:`PackedTiles.data` buffer.
+    """
+    if isinstance(data, PackedTiles):
+        data = data.data
+    raw = gid_array(data).tobytes()
+
+    gids = array.array(GID_TYPECODE)
+    flags = array.array("B")
+
+    if numpy is not None:
+        ndata = numpy.frombuffer(raw, dtype=numpy.uint32)
+        gids.frombytes((ndata & GID_MASK).tobytes())
+        flags.frombytes((ndata >> 28).astype(numpy.uint8).tobytes())
+        return gids, flags
+
+    # The flags live in the most significant byte of each integer.
+    high = 3 if sys.byteorder == "little" else 0
+    ndata = bytearray(raw)
+    flags.frombytes(raw[high::4].translate(_HIGH_FLAGS))
+    ndata[high::4] = raw[high::4].translate(_HIGH_GID)
+    gids.frombytes(ndata)
+
+    return gids, flags
+
+
+def number(value):
+    """
+    Return the float ``value`` as an int if it is integral, or as-is
+    otherwise.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    return int(value) if value.is_integer() else value
+
+
 def clean_dict(d: dict) -> dict:
     """
     Remove all entries in dictionary ``d`` with a value of
@@ -122,6 +410,94 @@ def clean_dict(d: dict) -> dict:
     return new_d
 
 
+def xml_source(fname, base_dir=None):
+    """
+    Return a tuple ``(source, fd)`` for reading the XML document
+    ``fname``, which can be a file name, a bytes-like object holding
+    the document, or a binary file object.  ``source`` is a file name
+    or binary file object which can be passed to the parsers of
+    :mod:`xml.etree.ElementTree`, and ``fd`` is the directory relative
+    paths in the document are relative to: ``base_dir`` if it isn't
+    :const:`None`, otherwise the directory containing the file for
+    file names, or the current directory for anything else.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    if isinstance(fname, (str, os.PathLike)):
+        source = fname
+        fd = os.path.dirname(fname)
+    elif isinstance(fname, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(fname)
+        fd = ""
+    else:
+        source = fname
+        fd = ""
+
+    if base_dir is not None:
+        fd = base_dir
+
+    return source, fd
+
+
+def iter_start_tags(fname, blocksize=65536):
+    """
+    Parse the XML document ``fname`` (see :func:`xml_source`)
+    incrementally and yield a tuple
+    ``(tag, attrib, parent)`` for each element start tag, where
+    ``attrib`` is a dictionary of the element's attributes and
+    ``parent`` is the tag of its parent element (:const:`None` for the
+    root element).  No tree is built and character data is skipped
+    entirely, and the file stops being read as soon as the generator
+    is closed.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    events = []
+    tags = []
+
+    def start(tag, attrib):
+        events.append((tag, attrib, tags[-1] if tags else None))
+        tags.append(tag)
+
+    def end(tag):
+        tags.pop()
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+
+    source, fd = xml_source(fname)
+    if isinstance(source, (str, os.PathLike)):
+        f = open(source, "rb")
+    else:
+        f = contextlib.nullcontext(source)
+
+    with f as f:
+        while True:
+            data = f.read(blocksize)
+            parser.Parse(data, not data)
+            yield from events
+            del events[:]
+            if not data:
+                break
+
+
+def read_root_attrib(fname):
+    """
+    Return a dictionary of the attributes of the root element of the
+    XML document ``fname`` (see :func:`xml_source`), reading no
+    further than its start tag.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    for tag, attrib, parent in iter_start_tags(fname):
+        return attrib
+    return {}
+
+
 def read_list_elem(root, tag, cls, fd):
     """
     Read all elements with the tag ``tag`` under XML element ``root``
@@ -137,59 +513,551 @@ def read_list_elem(root, tag, cls, fd):
     return objects
 
 
-def get_list_elem(objects, tag, fd, encoding, compression):
+def get_list_elem(objects, tag, fd, encoding, compression,
+                  compressionlevel):
     """
     Return an XML element with the tag ``tag``, appending XML elements
-    generated by calling ``get_elem(fd, encoding, compression)`` for
-    each member of ``objects``.
+    generated by calling
+    ``get_elem(fd, encoding, compression, compressionlevel)`` for each
+    member of ``objects``.
 
     This is a low-level function used internally by this library; you
     don't typically need to use it.
     """
     elem = ET.Element(tag)
     for obj in objects:
-        elem.append(obj.get_elem(fd, encoding, compression))
+        elem.append(obj.get_elem(fd, encoding, compression,
+                                 compressionlevel))
     return elem
 
 
-def read_tiles(elem, encoding, compression):
+def decode_tiles(data, encoding, compression, packed=False, cache=None,
+                 compressionlevel=None):
     """
-    Read the tile data from XML element ``elem`` and return a list of
-    :class:`LayerTile` objects.
+    Decode the encoded tile data ``data`` and return a list of
+    :class:`LayerTile` objects, or a :class:`PackedTiles` object if
+    ``packed`` is true.
+
+    If ``cache`` is not :const:`None`, it must be an encoded data cache
+    as used by :func:`write_tiles`, which is set to hold ``data`` as
+    the tiles encoded with ``encoding``, ``compression``, and
+    ``compressionlevel``, so that the tiles are written from it as long
+    as they are unchanged.
 
     This is a low-level function used internally by this library; you
     don't typically need to use it.
     """
-    tiles = []
+    if data is not None and data.strip():
+        tile_n = data_decode(data, encoding, compression)
+        if cache is not None:
+            cache.clear()
+            cache[(encoding, compression, compressionlevel)] = (
+                tiles_digest(tile_n), data.strip())
+    else:
+        tile_n = []
 
+    if packed:
+        return PackedTiles(tile_n)
+
+    return [LayerTile.from_int(n) for n in tile_n]
+
+
+def read_tiles(elem, encoding, compression, packed=False, cache=None,
+               compressionlevel=None):
+    """
+    Read the tile data from XML element ``elem`` and return a list of
+    :class:`LayerTile` objects, or a :class:`PackedTiles` object if
+    ``packed`` is true.  ``cache`` and ``compressionlevel`` are used
+    for encoded tile data as in :func:`decode_tiles`.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
     if encoding:
-        tile_n = data_decode(elem.text, encoding, compression)
-    else:
-        tile_n = [int(tile.attrib.get("gid", 0))
-                  for tile in elem.findall("tile")]
+        return decode_tiles(elem.text, encoding, compression, packed, cache,
+                            compressionlevel)
 
-    for n in tile_n:
-        gid = (n - (n & 2**31) - (n & 2**30) - (n & 2**29))
-        hflip = bool(n & 2**31)
-        vflip = bool(n & 2**30)
-        dflip = bool(n & 2**29)
-        tiles.append(LayerTile(gid, hflip, vflip, dflip))
+    tile_n = [int(tile.attrib.get("gid", 0)) for tile in elem.findall("tile")]
 
-    return tiles
+    if packed:
+        return PackedTiles(tile_n)
+
+    return [LayerTile.from_int(n) for n in tile_n]
 
 
-def write_tiles(tiles, elem, encoding, compression, compressionlevel):
+def read_points(s, packed=False):
     """
-    Write the list of tiles in ``tiles`` to XML element ``elem``.
+    Parse the value ``s`` of the ``points`` attribute of a polygon or
+    polyline element and return a list of coordinate pair tuples, or a
+    :class:`PackedPoints` object if ``packed`` is true.  Integral
+    coordinates are returned as integers.
+
+    All coordinates are converted in one pass, straight into a buffer
+    of floats.
 
     This is a low-level function used internally by this library; you
     don't typically need to use it.
     """
-    tile_n = [int(i) for i in tiles]
+    data = array.array("d", map(float, s.replace(",", " ").split()))
+    if len(data) % 2:
+        e = "Odd number of coordinates in points {!r}.".format(s)
+        raise ValueError(e)
 
-    if encoding:
-        elem.text = data_encode(tile_n, encoding, compression,
-                                compressionlevel)
+    if packed:
+        return PackedPoints(data)
+
+    values = [int(n) if n.is_integer() else n for n in data]
+    return list(zip(values[0::2], values[1::2]))
+
+
+def write_points(points, elem):
+    """
+    Set the ``points`` attribute of XML element ``elem`` to the
+    coordinate pairs ``points``.  ``points`` can be a
+    :class:`PackedPoints` object, in which case the coordinates are
+    formatted straight from its buffer.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    if isinstance(points, PackedPoints):
+        values = [str(int(n) if n.is_integer() else n)
+                  for n in points.data]
+        pairs = map(",".join, zip(values[0::2], values[1::2]))
+    else:
+        pairs = ["{},{}".format(*T) for T in points]
+    elem.set("points", " ".join(pairs))
+
+
+def write_tiles(tiles, elem, encoding, compression, compressionlevel,
+                cache=None):
+    """
+    Write the list of tiles in ``tiles`` to XML element ``elem``.
+    ``tiles`` can be a list of :class:`LayerTile` objects or a
+    :class:`PackedTiles` object, in which case the raw global tile IDs
+    are encoded directly from its buffer.
+
+    If ``cache`` is not :const:`None`, it must be a dictionary, in
+    which the encoded data is kept by encoding, compression, and
+    compression level along with a digest of the tiles it was encoded
+    from.  Only the most recently encoded (or lazily loaded; see
+    :func:`decode_tiles`) data is kept.  If the tiles are unchanged
+    since then and are encoded the same way, that data is reused
+    instead of encoding them again.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    if isinstance(tiles, PackedTiles):
+        tile_n = gid_array(tiles.data)
     else:
+        tile_n = gid_array(tiles)
+
+    if not encoding:
         for n in tile_n:
-            elem.append(ET.Element("tile", attrib={"gid": n}))
+            elem.append(ET.Element("tile", attrib={"gid": str(n)}))
+        return
+
+    digest = None
+    if cache is not None:
+        digest = tiles_digest(tile_n)
+        entry = cache.get((encoding, compression, compressionlevel))
+        if entry is not None and entry[0] == digest:
+            elem.text = entry[1]
+            return
+
+    job = (tile_n, elem, encoding, compression, compressionlevel, cache,
+           digest)
+    jobs = getattr(_pending, "jobs", None)
+    if jobs is not None:
+        jobs.append(job)
+    else:
+        _encode_job(job)
+
+
+def tiles_digest(tile_n):
+    """
+    Return a digest of the array of raw global tile IDs ``tile_n``
+    (see :func:`gid_array`), used to detect changes to tiles.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    return hashlib.blake2b(tile_n, digest_size=16).digest()
+
+
+def _encode_job(job):
+    # Encode tile data queued by write_tiles().
+    tile_n, elem, encoding, compression, compressionlevel, cache, digest = job
+    elem.text = data_encode(tile_n, encoding, compression, compressionlevel)
+    if cache is not None:
+        cache.clear()
+        cache[(encoding, compression, compressionlevel)] = (digest, elem.text)
+
+
+def write_elem(f, elem):
+    """
+    Write XML element ``elem`` to the binary file object ``f`` as
+    UTF-8, exactly as it would be written as part of a document by
+    :meth:`xml.etree.ElementTree.ElementTree.write`.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    ET.ElementTree(elem).write(f, encoding="UTF-8", xml_declaration=False)
+
+
+def write_open_elem(f, elem):
+    """
+    Write the start tag, text, and children of XML element ``elem`` to
+    the binary file object ``f`` as :func:`write_elem` would, leaving
+    the element open so that more children can be written after it.
+    The element must be closed with :func:`write_close_elem`.
+
+    Elements with no text or children must be written with
+    :func:`write_elem` instead, since they are written as empty-element
+    tags.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    end = "</{}>".format(elem.tag).encode("utf-8")
+    start = ET.tostring(ET.Element(elem.tag, elem.attrib), encoding="UTF-8",
+                        short_empty_elements=False)
+    f.write(start[:-len(end)])
+    if elem.text:
+        f.write(xml.sax.saxutils.escape(elem.text).encode("utf-8"))
+    for child in elem:
+        write_elem(f, child)
+
+
+def write_close_elem(f, elem):
+    """
+    Write the end tag of XML element ``elem``, opened with
+    :func:`write_open_elem`, to the binary file object ``f``.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    f.write("</{}>".format(elem.tag).encode("utf-8"))
+
+
+def write_tile_data(f, tiles, encoding):
+    """
+    Write the tile data :func:`write_tiles` would create for the list
+    of tiles in ``tiles`` to the binary file object ``f``, a block of
+    tiles at a time, without creating any XML elements or holding the
+    encoded data in memory in full.  ``encoding`` must be ``"csv"`` or
+    :const:`None` (for ``<tile>`` elements); other encodings can't be
+    written incrementally.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    if isinstance(tiles, PackedTiles):
+        tiles = tiles.data
+
+    for i in range(0, len(tiles), _TILE_DATA_BLOCK):
+        block = [int(n) for n in tiles[i:i + _TILE_DATA_BLOCK]]
+        if encoding == "csv":
+            text = ','.join(map(str, block))
+            if i:
+                text = ',' + text
+        elif not encoding:
+            text = "".join(['<tile gid="{}" />'.format(n) for n in block])
+        else:
+            e = 'Encoding type "{}" can\'t be streamed.'.format(encoding)
+            raise ValueError(e)
+        f.write(text.encode("utf-8"))
+
+
+def write_elems(f, objects, fd, encoding, compression, compressionlevel,
+                workers=None):
+    """
+    Write an XML element for each object in ``objects`` to the binary
+    file object ``f``, in order.
+
+    Objects which have a ``write_elem`` method and for which it can
+    stream their contents (group layers, and layers with chunks or
+    with CSV or unencoded tile data) are written with it, one at a
+    time.  The
+    elements of all other objects are created with their ``get_elem``
+    methods and written in batches of ``workers`` objects, encoding
+    their tile data in parallel as :func:`parallel_tiles` does, so that
+    only one batch of elements is kept in memory at a time.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    batch = []
+
+    def flush():
+        if not batch:
+            return
+        with parallel_tiles(workers):
+            elems = [obj.get_elem(fd, encoding, compression, compressionlevel)
+                     for obj in batch]
+        for elem in elems:
+            write_elem(f, elem)
+        del batch[:]
+
+    for obj in objects:
+        streams = getattr(obj, "_streams", None)
+        if streams is not None and streams(encoding):
+            flush()
+            obj.write_elem(f, fd, encoding, compression, compressionlevel,
+                           workers)
+        else:
+            batch.append(obj)
+            if len(batch) >= (workers or 1):
+                flush()
+
+    flush()
+
+
+@contextlib.contextmanager
+def parallel_tiles(workers):
+    """
+    Return a context manager which defers the encoding done by
+    :func:`write_tiles` in the current thread until the end of the
+    block, then encodes all of the deferred tile data using a pool of
+    ``workers`` threads.  Compression releases the GIL, so this scales
+    with the number of layers and chunks.  If ``workers`` is
+    :const:`None` or less than 2, tile data is encoded immediately as
+    usual.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    if not workers or workers < 2:
+        yield
+        return
+
+    jobs = []
+    _pending.jobs = jobs
+    try:
+        yield
+    finally:
+        _pending.jobs = None
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        list(executor.map(_encode_job, jobs))
+
+
+class ObservedList(list):
+
+    """
+    A list which reports every change to it by calling ``callback``
+    (if it isn't :const:`None`) with three arguments: a list of the
+    items added, a list of the items removed, and whether the items
+    which remain are still in the same order with any added items at
+    the end.  The items are reported after the change is made.
+
+    Copies and pickles of these lists are plain lists.
+
+    This is a low-level class used internally by this library; you
+    don't typically need to use it.
+    """
+
+    def __init__(self, iterable=(), callback=None):
+        super().__init__(iterable)
+        self.callback = callback
+
+    def __reduce_ex__(self, protocol):
+        return (list, (list(self),))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            removed = super().__getitem__(index)
+            value = list(value)
+            super().__setitem__(index, value)
+            self._changed(value, removed, False)
+        else:
+            removed = super().__getitem__(index)
+            super().__setitem__(index, value)
+            self._changed([value], [removed], False)
+
+    def __delitem__(self, index):
+        removed = super().__getitem__(index)
+        super().__delitem__(index)
+        if not isinstance(index, slice):
+            removed = [removed]
+        self._changed([], removed, True)
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, n):
+        old = list(self)
+        super().__imul__(n)
+        if n < 1:
+            self._changed([], old, True)
+        else:
+            self._changed(old * (n - 1), [], True)
+        return self
+
+    def append(self, value):
+        super().append(value)
+        self._changed([value], [], True)
+
+    def extend(self, values):
+        values = list(values)
+        super().extend(values)
+        self._changed(values, [], True)
+
+    def insert(self, index, value):
+        in_order = not self or index >= len(self)
+        super().insert(index, value)
+        self._changed([value], [], in_order)
+
+    def pop(self, index=-1):
+        value = super().pop(index)
+        self._changed([], [value], True)
+        return value
+
+    def remove(self, value):
+        del self[self.index(value)]
+
+    def clear(self):
+        removed = list(self)
+        super().clear()
+        self._changed([], removed, True)
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._changed([], [], False)
+
+    def reverse(self):
+        super().reverse()
+        self._changed([], [], False)
+
+    def _changed(self, added, removed, in_order):
+        if self.callback is not None:
+            self.callback(added, removed, in_order)
+
+
+class ChunkPager:
+
+    """
+    Keeps the tiles of at most ``budget`` :class:`LayerChunk` objects
+    decoded in memory at a time (see :meth:`TileMap.load`).  Chunks
+    using a pager report every access of their tiles to it, and when
+    there are too many, the tiles of the least recently used chunk are
+    dropped: if they are unchanged since they were loaded, the chunk
+    goes back to its encoded data, and otherwise the raw global tile
+    IDs are written to a temporary scratch file to be read back from
+    when they are next accessed.  Each chunk keeps its slot in the
+    scratch file, and reuses it whenever its tiles fit.
+
+    This is a low-level class used internally by this library; you
+    don't typically need to use it.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self._resident = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._scratch = None
+        self._end = 0
+
+    def touch(self, chunk, loaded=False):
+        """
+        Record an access of the tiles of ``chunk``, evicting the least
+        recently used chunks if there are more than :attr:`budget`.
+        ``loaded`` indicates that the tiles were just loaded.
+        """
+        with self._lock:
+            if loaded:
+                chunk._digest = tiles_digest(_chunk_gids(chunk))
+            self._resident[chunk] = None
+            self._resident.move_to_end(chunk)
+            # At most one more chunk is evicted than was added, so that
+            # chunks adopted over the budget are paged out gradually.
+            for i in range(2):
+                if len(self._resident) <= max(self.budget, 1):
+                    break
+                self._evict(self._resident.popitem(last=False)[0])
+
+    def adopt(self, chunk):
+        """
+        Start paging ``chunk``, whose tiles are already in memory,
+        without evicting anything.  It becomes the least recently used
+        chunk, and its tiles are written to the scratch file only once
+        it is evicted.
+        """
+        with self._lock:
+            chunk._digest = None
+            self._resident[chunk] = None
+            self._resident.move_to_end(chunk, last=False)
+
+    def read(self, chunk):
+        """
+        Return the tiles of ``chunk`` written to the scratch file.
+        """
+        offset, count, capacity, packed = chunk._spill
+        tile_n = array.array(GID_TYPECODE)
+        with self._lock:
+            self._scratch.seek(offset)
+            tile_n.frombytes(self._scratch.read(count * tile_n.itemsize))
+
+        tiles = PackedTiles(tile_n)
+        return tiles if packed else list(tiles)
+
+    def _evict(self, chunk):
+        if chunk._tiles is None:
+            return
+
+        tile_n = _chunk_gids(chunk)
+        saved = chunk._encoded is not None or chunk._spill is not None
+        if not saved or chunk._digest != tiles_digest(tile_n):
+            packed = isinstance(chunk._tiles, PackedTiles)
+            data = tile_n.tobytes()
+            if self._scratch is None:
+                self._scratch = tempfile.TemporaryFile()
+            # Chunks rewritten with no more tiles than their slot holds
+            # reuse it.
+            if chunk._spill is not None and chunk._spill[2] >= len(tile_n):
+                offset = chunk._spill[0]
+                capacity = chunk._spill[2]
+            else:
+                offset = self._end
+                capacity = len(tile_n)
+                self._end += len(data)
+            self._scratch.seek(offset)
+            self._scratch.write(data)
+            chunk._spill = (offset, len(tile_n), capacity, packed)
+            chunk._encoded = None
+
+        chunk._tiles = None
+        chunk._digest = None
+
+
+def _chunk_gids(chunk):
+    # Return the raw global tile IDs of the decoded tiles of a chunk.
+    tiles = chunk._tiles
+    if isinstance(tiles, PackedTiles):
+        return gid_array(tiles.data)
+    return gid_array(tiles)
+
+
+def decode_parallel(objects, workers):
+    """
+    Decode the tile data of each :class:`Layer` or :class:`LayerChunk`
+    object in ``objects`` that is still encoded (see
+    :meth:`TileMap.load`), using a pool of ``workers`` threads.  If
+    ``workers`` is :const:`None` or less than 2, the tile data is
+    decoded in the calling thread instead.
+
+    This is a low-level function used internally by this library; you
+    don't typically need to use it.
+    """
+    objects = [obj for obj in objects if obj._tiles is None]
+    if not workers or workers < 2:
+        for obj in objects:
+            obj._decode(False)
+        return
+
+    # The encoded data isn't kept, as with tiles read without ``lazy``.
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        list(executor.map(lambda obj: obj._decode(False), objects))